@@ -0,0 +1,234 @@
+"""Cross-process coordination for running several uvicorn workers
+
+FileLock serialises critical sections between processes (Drive token refresh,
+invoice number allocation, schema migrations). LeaderLock elects a single
+process to run a background job: the first worker to take it keeps it until it
+exits, and the others skip the job.
+
+Lock files live in LOCK_DIR (default: ../run/locks next to the backend), so
+they only coordinate workers on one machine. With PostgreSQL, named locks are
+PostgreSQL advisory locks instead (AdvisoryLock), shared by workers on every
+machine using the database.
+"""
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_DIR = os.environ.get("LOCK_DIR", os.path.join(os.path.dirname(__file__), "..", "run", "locks"))
+
+def lock_path(name: str) -> str:
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    return os.path.join(LOCK_DIR, f"{name}.lock")
+
+class FileLock:
+    """Exclusive advisory lock on a file, shared by threads and processes
+
+    Not re-entrant. Threads of the same process queue on a threading.Lock
+    before taking the file lock, so one FileLock object serves a whole process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._thread_lock.acquire(blocking, -1 if timeout is None or not blocking else timeout):
+            return False
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return True
+            except OSError:
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    os.close(fd)
+                    self._thread_lock.release()
+                    return False
+                time.sleep(0.01)
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        try:
+            if fcntl:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+            self._thread_lock.release()
+
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class AdvisoryLock:
+    """PostgreSQL session advisory lock, with the FileLock interface
+
+    The lock is held on a connection of its own, taken from the engine's pool
+    while the lock is held; if that connection drops, PostgreSQL releases the
+    lock. Not re-entrant; threads of a process queue as with FileLock.
+    """
+
+    def __init__(self, engine, name: str):
+        from sqlalchemy import text
+
+        self._text = text
+        self.engine = engine
+        # pg_advisory_lock takes a signed 64-bit key
+        self.key = int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), "big", signed=True)
+        self._thread_lock = threading.Lock()
+        self._conn = None
+
+    def _execute(self, conn, sql: str):
+        value = conn.execute(self._text(sql), {"key": self.key}).scalar()
+        # Session locks outlive the transaction; don't sit idle in one
+        conn.commit()
+        return value
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._thread_lock.acquire(blocking, -1 if timeout is None or not blocking else timeout):
+            return False
+        try:
+            conn = self.engine.connect()
+        except Exception:
+            self._thread_lock.release()
+            raise
+        try:
+            while not self._execute(conn, "SELECT pg_try_advisory_lock(:key)"):
+                if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                    conn.close()
+                    self._thread_lock.release()
+                    return False
+                time.sleep(0.05)
+        except Exception:
+            conn.close()
+            self._thread_lock.release()
+            raise
+        self._conn = conn
+        return True
+
+    def release(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            self._execute(conn, "SELECT pg_advisory_unlock(:key)")
+        except Exception as e:
+            # The connection is gone, and the lock with it
+            print(f"Note: could not release advisory lock {self.key}: {e}")
+        finally:
+            conn.close()
+            self._thread_lock.release()
+
+    def held(self) -> bool:
+        """Whether the lock is still ours (False once its connection dropped)"""
+        if self._conn is None:
+            return False
+        try:
+            self._conn.execute(self._text("SELECT 1"))
+            self._conn.commit()
+            return True
+        except Exception:
+            return False
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+_locks = {}
+_locks_guard = threading.Lock()
+
+def named_lock(name: str) -> Union[FileLock, AdvisoryLock]:
+    """The process-wide lock for `name` (one per name, so threads share it)
+
+    An AdvisoryLock when the database is PostgreSQL, a FileLock otherwise.
+    """
+    from database import engine
+
+    with _locks_guard:
+        if name not in _locks:
+            if engine.dialect.name == "postgresql":
+                _locks[name] = AdvisoryLock(engine, name)
+            else:
+                _locks[name] = FileLock(lock_path(name))
+        return _locks[name]
+
+@contextmanager
+def exclusive(name: str):
+    """Run the body while holding the named cross-process lock"""
+    lock = named_lock(name)
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+
+class LeaderLock:
+    """Non-blocking election of the one process that runs a background job"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = named_lock(f"leader-{name}")
+        self.is_leader = False
+
+    def try_acquire(self) -> bool:
+        """Become leader if no other process is; safe to call repeatedly"""
+        if self.is_leader and not self._lock.held():
+            # Lost the lock (its database connection dropped); another process may lead now
+            self.release()
+        if not self.is_leader:
+            self.is_leader = self._lock.acquire(blocking=False)
+        return self.is_leader
+
+    def release(self):
+        if self.is_leader:
+            self._lock.release()
+            self.is_leader = False
+
+def run_as_leader(name: str, job: Callable[[], None], wait: Callable[[], float], stop: threading.Event):
+    """Run `job` every `wait()` seconds in whichever process holds the leader lock `name`
+
+    Meant as a thread target; returns once `stop` is set. Processes that are not
+    leader keep trying, so another one takes over when the leader exits.
+    """
+    leader = LeaderLock(name)
+    try:
+        while not stop.is_set():
+            if leader.try_acquire():
+                try:
+                    job()
+                except Exception as e:
+                    import traceback
+                    print(f"Error in background job {name}: {e}")
+                    traceback.print_exc()
+            stop.wait(wait())
+    finally:
+        leader.release()
@@ -1,77 +1,102 @@
 import os
 import pickle
 from typing import Tuple
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
 from io import BytesIO
 
+# The Google client libraries are slow to import, so they are imported where
+# they are used rather than at module load (see startup.py for the warm-up)
+
 # Scopes required for Google Drive API
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
-def get_credentials():
-    """Get valid user credentials from storage or prompt for authorization"""
-    creds = None
-    credentials_dir = os.path.join(os.path.dirname(__file__), "..", "credentials")
-    token_path = os.path.join(credentials_dir, "token.pickle")
-    
-    # Create credentials directory if it doesn't exist
-    os.makedirs(credentials_dir, exist_ok=True)
-    
-    # Find credentials file (could be credentials.json or client_secret_*.json)
-    credentials_path = None
-    possible_names = [
-        "credentials.json",
-        "client_secret_*.json",
-    ]
-    
-    # First try exact match
-    exact_path = os.path.join(credentials_dir, "credentials.json")
-    if os.path.exists(exact_path):
-        credentials_path = exact_path
-    else:
-        # Look for client_secret files
-        import glob
-        client_secret_files = glob.glob(os.path.join(credentials_dir, "client_secret_*.json"))
-        if client_secret_files:
-            credentials_path = client_secret_files[0]
-    
-    # Load existing token if available
-    if os.path.exists(token_path):
-        with open(token_path, 'rb') as token:
-            creds = pickle.load(token)
-    
-    # If there are no (valid) credentials available, let the user log in
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            try:
-                creds.refresh(Request())
-            except Exception as e:
-                # invalid_grant usually means token was revoked or expired beyond refresh
-                err_str = str(e).lower()
-                if "invalid_grant" in err_str or "token has been revoked" in err_str or "token expired" in err_str:
-                    if os.path.exists(token_path):
-                        os.remove(token_path)
-                    creds = None
-                else:
-                    raise
+# Credentials shared by all threads of this process (see get_credentials)
+_cached_credentials = None
+
+def build(*args, **kwargs):
+    """googleapiclient.discovery.build, imported on first use"""
+    from googleapiclient.discovery import build as discovery_build
+    return discovery_build(*args, **kwargs)
 
+def get_credentials():
+    """Get valid user credentials from storage or prompt for authorization
+    
+    Valid credentials are cached in memory. Loading, refreshing and saving the
+    token happens under a cross-process lock, so with several workers only one
+    refreshes an expired token (or runs the authorization flow) and the others
+    pick up the token it saved.
+    """
+    global _cached_credentials
+    creds = _cached_credentials
+    if creds and creds.valid:
+        return creds
+    
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from coordination import exclusive
+    
+    with exclusive("drive-token"):
+        creds = None
+        credentials_dir = os.path.join(os.path.dirname(__file__), "..", "credentials")
+        token_path = os.path.join(credentials_dir, "token.pickle")
+        
+        # Create credentials directory if it doesn't exist
+        os.makedirs(credentials_dir, exist_ok=True)
+        
+        # Find credentials file (could be credentials.json or client_secret_*.json)
+        credentials_path = None
+        possible_names = [
+            "credentials.json",
+            "client_secret_*.json",
+        ]
+        
+        # First try exact match
+        exact_path = os.path.join(credentials_dir, "credentials.json")
+        if os.path.exists(exact_path):
+            credentials_path = exact_path
+        else:
+            # Look for client_secret files
+            import glob
+            client_secret_files = glob.glob(os.path.join(credentials_dir, "client_secret_*.json"))
+            if client_secret_files:
+                credentials_path = client_secret_files[0]
+        
+        # Load existing token if available
+        if os.path.exists(token_path):
+            with open(token_path, 'rb') as token:
+                creds = pickle.load(token)
+        
+        # If there are no (valid) credentials available, let the user log in
         if not creds or not creds.valid:
-            if not credentials_path:
-                raise FileNotFoundError(
-                    f"Google credentials not found in {credentials_dir}. "
-                    "Please download credentials.json (or client_secret_*.json) from Google Cloud Console "
-                    "and place it in the credentials/ folder."
-                )
-            flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
-            creds = flow.run_local_server(port=0)
+            if creds and creds.expired and creds.refresh_token:
+                try:
+                    creds.refresh(Request())
+                except Exception as e:
+                    # invalid_grant usually means token was revoked or expired beyond refresh
+                    err_str = str(e).lower()
+                    if "invalid_grant" in err_str or "token has been revoked" in err_str or "token expired" in err_str:
+                        if os.path.exists(token_path):
+                            os.remove(token_path)
+                        creds = None
+                    else:
+                        raise
 
-        # Save the credentials for the next run
-        with open(token_path, 'wb') as token:
-            pickle.dump(creds, token)
+            if not creds or not creds.valid:
+                if not credentials_path:
+                    raise FileNotFoundError(
+                        f"Google credentials not found in {credentials_dir}. "
+                        "Please download credentials.json (or client_secret_*.json) from Google Cloud Console "
+                        "and place it in the credentials/ folder."
+                    )
+                flow = InstalledAppFlow.from_client_secrets_file(credentials_path, SCOPES)
+                creds = flow.run_local_server(port=0)
 
+            # Save the credentials for the next run (atomically, other workers may be reading)
+            tmp_path = f"{token_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as token:
+                pickle.dump(creds, token)
+            os.replace(tmp_path, token_path)
+    
+    _cached_credentials = creds
     return creds
 
 def get_or_create_folder(service, folder_name, parent_id=None):
@@ -124,6 +149,8 @@ def upload_to_drive(pdf_bytes: bytes, filename: str, client_name: str, invoice_n
     Returns:
         tuple: (file_id, file_url, folder_id)
     """
+    from googleapiclient.http import MediaIoBaseUpload
+    
     creds = get_credentials()
     service = build('drive', 'v3', credentials=creds)
     
@@ -175,6 +202,7 @@ def upload_file_to_invoice_folder(folder_id: str, file_bytes: bytes, filename: s
         tuple: (file_id, file_url)
     """
     import mimetypes
+    from googleapiclient.http import MediaIoBaseUpload
     
     creds = get_credentials()
     service = build('drive', 'v3', credentials=creds)
@@ -207,6 +235,65 @@ def upload_file_to_invoice_folder(folder_id: str, file_bytes: bytes, filename: s
     
     return file_id, file_url
 
+def update_drive_file(file_id: str, file_bytes: bytes, filename: str = None, mime_type: str = 'application/pdf') -> Tuple[str, str, str]:
+    """
+    Upload new content for an existing Google Drive file (Drive keeps the old
+    content as a previous revision)
+    
+    Args:
+        file_id: The Google Drive file ID to update
+        file_bytes: The new file content as bytes
+        filename: New name for the file (unchanged if not provided)
+        mime_type: The MIME type of the new content
+    
+    Returns:
+        tuple: (file_id, file_url, revision_id)
+    """
+    from googleapiclient.http import MediaIoBaseUpload
+    
+    creds = get_credentials()
+    service = build('drive', 'v3', credentials=creds)
+    
+    media = MediaIoBaseUpload(
+        BytesIO(file_bytes),
+        mimetype=mime_type,
+        resumable=False
+    )
+    
+    file = service.files().update(
+        fileId=file_id,
+        body={'name': filename} if filename else {},
+        media_body=media,
+        fields='id, headRevisionId, webViewLink, webContentLink'
+    ).execute()
+    
+    file_url = file.get('webContentLink') or file.get('webViewLink')
+    
+    return file.get('id'), file_url, file.get('headRevisionId')
+
+def download_from_drive(file_id: str) -> bytes:
+    """
+    Download the content of a file from Google Drive
+    
+    Args:
+        file_id: The Google Drive file ID to download
+    
+    Returns:
+        bytes: The file content
+    """
+    from googleapiclient.http import MediaIoBaseDownload
+    
+    creds = get_credentials()
+    service = build('drive', 'v3', credentials=creds)
+    
+    buffer = BytesIO()
+    downloader = MediaIoBaseDownload(buffer, service.files().get_media(fileId=file_id))
+    done = False
+    while not done:
+        _, done = downloader.next_chunk()
+    
+    return buffer.getvalue()
+
 def delete_from_drive(file_id: str):
     """
     Delete a file from Google Drive by its file ID
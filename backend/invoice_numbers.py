@@ -0,0 +1,84 @@
+"""Invoice number generation and allocation
+
+Numbers are YYYYMM## where ## is the invoice's sequence within the month.
+next_invoice_number() only suggests a number; two clients asking at the same
+time get the same answer. Creating an invoice without a number allocates one
+inside allocation_lock(), which serialises allocation across threads, worker
+processes and (with PostgreSQL) machines.
+"""
+from contextlib import contextmanager
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import Invoice
+
+# Arbitrary key for pg_advisory_xact_lock
+ADVISORY_LOCK_KEY = 7305201
+
+def _month_sequences(db: Session, year_month: str) -> List[int]:
+    # Find all invoices for this month (starting with YYYYMM)
+    month_numbers = db.query(Invoice.invoice_number).filter(
+        Invoice.invoice_number.like(f"{year_month}%")
+    ).all()
+
+    # Extract the sequence numbers from existing invoices
+    sequence_numbers = []
+    for (number,) in month_numbers:
+        # Invoice number format: YYYYMM## (8 digits total)
+        # Handle both old format (YYYYMMDD) and new format (YYYYMM##)
+        if len(number) == 8 and number[:6] == year_month:
+            try:
+                # For old format (YYYYMMDD), we'll use the day as sequence
+                # For new format (YYYYMM##), we'll use the ## as sequence
+                sequence_numbers.append(int(number[6:8]))
+            except ValueError:
+                # Skip if not in expected format
+                pass
+    return sequence_numbers
+
+def next_invoice_numbers(db: Session, count: int, today: Optional[date] = None) -> List[str]:
+    """The next `count` free invoice numbers for the month of `today`"""
+    today = today or date.today()
+    year_month = today.strftime("%Y%m")
+    sequence_numbers = _month_sequences(db, year_month)
+    next_sequence = max(sequence_numbers) + 1 if sequence_numbers else 1
+
+    # Format as YYYYMM## with zero-padded sequence (always 2 digits)
+    numbers = []
+    while len(numbers) < count:
+        invoice_number = f"{year_month}{next_sequence:02d}"
+        # Double-check uniqueness (in case of edge cases)
+        if not db.query(Invoice.id).filter(Invoice.invoice_number == invoice_number).first():
+            numbers.append(invoice_number)
+        next_sequence += 1
+    return numbers
+
+def next_invoice_number(db: Session, today: Optional[date] = None) -> str:
+    """The next free invoice number for the month of `today`"""
+    return next_invoice_numbers(db, 1, today)[0]
+
+@contextmanager
+def allocation_lock(db: Session):
+    """Hold the invoice number allocation lock until the block ends
+
+    Commit the new invoices inside the block so the next allocation sees them.
+    Whatever the block leaves uncommitted (nothing to allocate, an error) is
+    rolled back on the way out.
+    """
+    try:
+        if db.get_bind().dialect.name == "postgresql":
+            # Released automatically when the transaction ends
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            yield
+        else:
+            from coordination import exclusive
+            with exclusive("invoice-numbers"):
+                yield
+    finally:
+        # End the transaction on every path (e.g. an early return without a
+        # commit), so the advisory lock is not held past the block
+        if db.in_transaction():
+            db.rollback()
@@ -1,42 +1,52 @@
+import startup  # first, so start-up timing includes the imports below
 from fastapi import FastAPI, Depends, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 from datetime import date
 import os
 
 from database import get_db, init_db
-from models import Party, Invoice, LineItem, Config
+from models import Party, Invoice, InvoiceRevision, LineItem, Config, InvoiceTemplate, TemplateLineItem, Attachment
 from schemas import (
     Party as PartySchema, PartyCreate,
-    Invoice as InvoiceSchema, InvoiceCreate,
-    LineItem as LineItemSchema,
+    Invoice as InvoiceSchema, InvoiceCreate, InvoiceUpdate,
+    InvoiceRevision as InvoiceRevisionSchema,
+    Attachment as AttachmentSchema,
+    LineItem as LineItemSchema, LineItemUpdate,
+    InvoiceTemplate as InvoiceTemplateSchema, InvoiceTemplateCreate,
     Config as ConfigSchema, ConfigCreate
 )
-from pdf_generator import generate_pdf
-from google_drive import upload_to_drive, upload_file_to_invoice_folder
+from pdf_generator import generate_pdf, choose_engine, render_hash
+from invoice_numbers import next_invoice_number, allocation_lock
+from storage import get_storage
+import scheduler
+import reconcile
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
+    startup.mark("imports")
     init_db()
+    startup.mark("init_db")
+    
+    # Check Google Drive credentials (using the existing token or triggering the
+    # auth flow) and pre-import heavy modules in the background, so the server
+    # starts accepting requests right away. /api/drive/status reports the result.
+    startup.start_background_tasks()
+    # Generate recurring invoices now (in case a period started while the
+    # server was down) and then periodically
+    scheduler.start_scheduler()
+    # Periodically bring drive_* IDs in line with storage and retry failed uploads
+    reconcile.start_reconciler()
+    startup.mark("ready")
     
-    # Try to initialize Google Drive credentials on startup
-    # This will either use the existing token or trigger the auth flow
-    try:
-        from google_drive import get_credentials
-        print("Checking Google Drive credentials...")
-        get_credentials()
-        print("Google Drive credentials ready.")
-    except FileNotFoundError:
-        print("Google Drive credentials not found. Please place credentials.json in the credentials/ folder.")
-    except Exception as e:
-        print(f"Note: Google Drive authentication not completed on startup: {e}")
-        print("You will be prompted to authenticate when generating your first invoice.")
-        
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    scheduler.stop_scheduler()
+    reconcile.stop_reconciler()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -83,6 +93,7 @@ def update_party(party_id: int, party: PartyCreate, db: Session = Depends(get_db
 
 @app.delete("/api/parties/{party_id}")
 def delete_party(party_id: int, db: Session = Depends(get_db)):
+    """Delete a party, and its invoice templates (no more recurring invoices)"""
     db_party = db.query(Party).filter(Party.id == party_id).first()
     if not db_party:
         raise HTTPException(status_code=404, detail="Party not found")
@@ -93,11 +104,12 @@ def delete_party(party_id: int, db: Session = Depends(get_db)):
 # Invoice endpoints
 @app.get("/api/invoices", response_model=List[InvoiceSchema])
 def list_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    from sqlalchemy.orm import joinedload
+    from sqlalchemy.orm import joinedload, selectinload
     try:
         invoices = db.query(Invoice).options(
             joinedload(Invoice.party),
-            joinedload(Invoice.line_items)
+            joinedload(Invoice.line_items),
+            selectinload(Invoice.attachments)
         ).order_by(Invoice.date.desc()).offset(skip).limit(limit).all()
         
         # Convert to schema manually to ensure proper serialization
@@ -110,8 +122,22 @@ def list_invoices(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)
         raise HTTPException(status_code=500, detail=f"Error loading invoices: {str(e)}")
 
 @app.post("/api/invoices", response_model=InvoiceSchema)
-def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
+def create_invoice(invoice: InvoiceCreate, pdf_engine: Optional[str] = None, db: Session = Depends(get_db)):
+    """Create an invoice, render its PDF and upload it
+    
+    Without an invoice_number, the next number is allocated atomically (safe
+    with several workers); a number that is already taken returns 409.
+    pdf_engine selects the renderer ("html", "direct" or "auto"); by default
+    large invoices use the direct engine (see pdf_generator.choose_engine).
+    """
     try:
+        try:
+            # Reject an unknown engine before saving anything; "auto" is resolved
+            # when rendering, since it also depends on the invoice's text
+            choose_engine(pdf_engine, len(invoice.line_items))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
         party = db.query(Party).filter(Party.id == invoice.party_id).first()
         if not party:
             raise HTTPException(status_code=404, detail="Party not found")
@@ -121,9 +147,20 @@ def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
         line_items_data = invoice_data.pop("line_items")
         invoice_data["payment_term"] = party.payment_term or "30 days"
         
-        db_invoice = Invoice(**invoice_data)
-        db.add(db_invoice)
-        db.commit()
+        if invoice_data["invoice_number"]:
+            db_invoice = Invoice(**invoice_data)
+            db.add(db_invoice)
+            try:
+                db.commit()
+            except IntegrityError:
+                db.rollback()
+                raise HTTPException(status_code=409, detail=f"Invoice number {invoice_data['invoice_number']} already exists")
+        else:
+            with allocation_lock(db):
+                invoice_data["invoice_number"] = next_invoice_number(db)
+                db_invoice = Invoice(**invoice_data)
+                db.add(db_invoice)
+                db.commit()
         db.refresh(db_invoice)
         
         # Create line items
@@ -149,11 +186,12 @@ def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
         if not config:
             raise HTTPException(status_code=400, detail="Business config not set. Please configure your business details first.")
         
-        pdf_bytes = generate_pdf(db_invoice, party, config, line_items)
+        pdf_bytes = generate_pdf(db_invoice, party, config, line_items, engine=pdf_engine)
+        content_hash = render_hash(db_invoice, party, config, line_items)
         
-        # Upload to Google Drive
+        # Upload to storage (Google Drive unless STORAGE_BACKEND says otherwise)
         try:
-            file_id, file_url, folder_id = upload_to_drive(
+            file_id, file_url, folder_id = get_storage().upload_invoice_pdf(
                 pdf_bytes,
                 f"invoice_{db_invoice.invoice_number}.pdf",
                 party.company_name,
@@ -162,6 +200,13 @@ def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
             db_invoice.drive_file_id = file_id
             db_invoice.drive_file_url = file_url
             db_invoice.drive_folder_id = folder_id
+            db_invoice.render_hash = content_hash
+            db.add(InvoiceRevision(
+                invoice_id=db_invoice.id,
+                revision=1,
+                render_hash=content_hash,
+                drive_file_id=file_id
+            ))
             db.commit()
             # Reload with relationships again after update
             db_invoice = db.query(Invoice).options(
@@ -173,9 +218,10 @@ def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
             print(f"Google Drive credentials not found: {e}")
             print("Invoice created but not uploaded to Drive. Please set up Google Drive credentials.")
         except Exception as e:
-            # Log error but don't fail the invoice creation
+            # Log error but don't fail the invoice creation; reconciliation
+            # (reconcile.py) retries the upload later
             import traceback
-            print(f"Error uploading to Google Drive: {e}")
+            print(f"Error uploading to storage: {e}")
             traceback.print_exc()
         
         # Return the invoice with relationships loaded
@@ -190,78 +236,210 @@ def create_invoice(invoice: InvoiceCreate, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=f"Error creating invoice: {str(e)}")
 
 @app.get("/api/drive/status")
-def get_drive_status():
-    """Check if Google Drive credentials are set up and working"""
+def get_drive_status(refresh: bool = False):
+    """Check if the storage backend (Google Drive by default) is set up and working
+    
+    Returns the result of the background check started at startup ("pending"
+    while it runs); pass refresh=true to check again now.
+    """
+    return startup.storage_status(refresh=refresh)
+
+@app.get("/api/reconcile")
+def get_reconcile_report(db: Session = Depends(get_db)):
+    """Drift found by the last reconciliation pass between the database and storage"""
+    report = reconcile.last_report(db)
+    if report is None:
+        raise HTTPException(status_code=404, detail="No reconciliation has run yet")
+    return report
+
+@app.post("/api/reconcile")
+def run_reconcile(full: bool = False, db: Session = Depends(get_db)):
+    """Reconcile the database with storage now
+    
+    Processes the storage changes since the last pass; full=true checks every
+    stored file and folder ID instead.
+    """
     try:
-        from google_drive import get_credentials
-        from googleapiclient.discovery import build
-        
-        creds = get_credentials()
-        if not creds or not creds.valid:
-            return {"status": "error", "message": "Credentials invalid or expired"}
-        
-        service = build('drive', 'v3', credentials=creds)
-        # Try a simple API call
-        service.about().get(fields="user").execute()
-        
-        return {"status": "ok", "message": "Google Drive connected"}
-    except FileNotFoundError as e:
-        return {"status": "error", "message": f"Credentials file not found: {str(e)}"}
+        return reconcile.reconcile(db, full=full)
     except Exception as e:
-        return {"status": "error", "message": str(e)}
+        import traceback
+        print(f"Error reconciling with storage: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error reconciling with storage: {str(e)}")
+
+@app.get("/api/startup")
+def get_startup_timings():
+    """Milliseconds from the start of main.py's imports to each startup phase"""
+    return startup.timings()
 
 @app.get("/api/invoices/next-number")
 def get_next_invoice_number(db: Session = Depends(get_db)):
-    """Generate next invoice number in YYYYMM## format where ## is the invoice number for the month"""
-    today = date.today()
-    year_month = today.strftime("%Y%m")
+    """Generate next invoice number in YYYYMM## format where ## is the invoice number for the month
     
-    # Find all invoices for this month (starting with YYYYMM)
-    month_invoices = db.query(Invoice).filter(
-        Invoice.invoice_number.like(f"{year_month}%")
-    ).all()
+    This is a suggestion: concurrent callers may get the same number. Omit
+    invoice_number when creating an invoice to have one allocated atomically.
+    """
+    return {"invoice_number": next_invoice_number(db)}
+
+@app.get("/api/invoices/{invoice_id}", response_model=InvoiceSchema)
+def get_invoice(invoice_id: int, db: Session = Depends(get_db)):
+    invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return invoice
+
+def apply_line_item_changes(db_invoice: Invoice, items: List[LineItemUpdate]) -> dict:
+    """Update the invoice's line items in place to match `items`
     
-    # Extract the sequence numbers from existing invoices
-    sequence_numbers = []
-    for inv in month_invoices:
-        # Invoice number format: YYYYMM## (8 digits total)
-        # Handle both old format (YYYYMMDD) and new format (YYYYMM##)
-        if len(inv.invoice_number) >= 8 and inv.invoice_number[:6] == year_month:
-            try:
-                # Try to extract last 2 digits as sequence
-                # For old format (YYYYMMDD), we'll use the day as sequence
-                # For new format (YYYYMM##), we'll use the ## as sequence
-                if len(inv.invoice_number) == 8:
-                    seq = int(inv.invoice_number[6:8])
-                    sequence_numbers.append(seq)
-            except ValueError:
-                # Skip if not in expected format
-                pass
+    Items with the id of an existing line item update it, other items are added,
+    and existing line items missing from `items` are removed. Returns counts of
+    added/updated/removed/unchanged line items.
+    """
+    existing = {item.id: item for item in db_invoice.line_items}
+    seen = set()
+    counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0}
     
-    # Get the next sequence number
-    if sequence_numbers:
-        next_sequence = max(sequence_numbers) + 1
-    else:
-        next_sequence = 1
+    for item in items:
+        data = item.model_dump(exclude={"id"})
+        current = existing.get(item.id) if item.id not in seen else None
+        if current is None:
+            db_invoice.line_items.append(LineItem(**data))
+            counts["added"] += 1
+            continue
+        seen.add(item.id)
+        changed = False
+        for key, value in data.items():
+            if getattr(current, key) != value:
+                setattr(current, key, value)
+                changed = True
+        counts["updated" if changed else "unchanged"] += 1
     
-    # Format as YYYYMM## with zero-padded sequence (always 2 digits)
-    invoice_number = f"{year_month}{next_sequence:02d}"
+    for item_id, item in existing.items():
+        if item_id not in seen:
+            db_invoice.line_items.remove(item)
+            counts["removed"] += 1
     
-    # Double-check uniqueness (in case of edge cases)
-    existing = db.query(Invoice).filter(Invoice.invoice_number == invoice_number).first()
-    if existing:
-        # If somehow it exists, increment
-        next_sequence += 1
-        invoice_number = f"{year_month}{next_sequence:02d}"
+    return counts
+
+@app.put("/api/invoices/{invoice_id}", response_model=InvoiceSchema)
+def update_invoice(
+    invoice_id: int,
+    invoice: InvoiceUpdate,
+    pdf_engine: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """Update an invoice and its line items
     
-    return {"invoice_number": invoice_number}
+    The PDF is only re-rendered if something printed on it changed, and is
+    uploaded as a new revision of the existing file (the invoice folder and its
+    attachments are left alone). Each upload is recorded in the revision history.
+    If the upload fails the edit is still saved, with pdf_stale set until
+    reconciliation uploads the new PDF.
+    """
+    from sqlalchemy.orm import joinedload
+    try:
+        db_invoice = db.query(Invoice).options(
+            joinedload(Invoice.party),
+            joinedload(Invoice.line_items)
+        ).filter(Invoice.id == invoice_id).first()
+        if not db_invoice:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+        
+        try:
+            # Only validated here, as in create_invoice
+            choose_engine(pdf_engine, len(invoice.line_items))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        # Changing client takes the new client's payment term, as on creation
+        party = db_invoice.party
+        if invoice.party_id != db_invoice.party_id:
+            party = db.query(Party).filter(Party.id == invoice.party_id).first()
+            if not party:
+                raise HTTPException(status_code=404, detail="Party not found")
+            db_invoice.party = party
+            db_invoice.payment_term = party.payment_term or "30 days"
+        
+        if invoice.invoice_number != db_invoice.invoice_number:
+            duplicate = db.query(Invoice).filter(
+                Invoice.invoice_number == invoice.invoice_number,
+                Invoice.id != invoice_id
+            ).first()
+            if duplicate:
+                raise HTTPException(status_code=409, detail="Invoice number already in use")
+            db_invoice.invoice_number = invoice.invoice_number
+        db_invoice.date = invoice.date
+        
+        counts = apply_line_item_changes(db_invoice, invoice.line_items)
+        line_items = list(db_invoice.line_items)
+        
+        config = db.query(Config).first()
+        if not config:
+            raise HTTPException(status_code=400, detail="Business config not set. Please configure your business details first.")
+        
+        # Nothing printed on the invoice changed: keep the current PDF
+        content_hash = render_hash(db_invoice, party, config, line_items)
+        if content_hash == db_invoice.render_hash and db_invoice.drive_file_id:
+            # (e.g. an edit whose upload failed was reverted)
+            db_invoice.pdf_stale = False
+            db.commit()
+            return db_invoice
+        
+        pdf_bytes = generate_pdf(db_invoice, party, config, line_items, engine=pdf_engine)
+        filename = f"invoice_{db_invoice.invoice_number}.pdf"
+        
+        try:
+            storage = get_storage()
+            revision_id = None
+            if db_invoice.drive_file_id:
+                # New revision of the existing file
+                file_id, file_url, revision_id = storage.update(
+                    db_invoice.drive_file_id, pdf_bytes, filename, "application/pdf"
+                )
+            else:
+                # Never uploaded (e.g. storage was unavailable on creation)
+                file_id, file_url, folder_id = storage.upload_invoice_pdf(
+                    pdf_bytes, filename, party.company_name, db_invoice.invoice_number
+                )
+                db_invoice.drive_folder_id = folder_id
+            db_invoice.drive_file_id = file_id
+            db_invoice.drive_file_url = file_url
+            db_invoice.render_hash = content_hash
+            db_invoice.pdf_stale = False
+            
+            summary = ", ".join(f"{n} {kind}" for kind, n in counts.items() if n and kind != "unchanged")
+            db_invoice.revisions.append(InvoiceRevision(
+                revision=max((r.revision for r in db_invoice.revisions), default=0) + 1,
+                render_hash=content_hash,
+                drive_file_id=file_id,
+                drive_revision_id=revision_id,
+                changes=summary or "details changed"
+            ))
+        except Exception as e:
+            # Log error but don't fail the update: the invoice is flagged with
+            # pdf_stale and reconciliation (scheduler.render_pending) uploads it
+            import traceback
+            print(f"Error uploading updated invoice to storage: {e}")
+            traceback.print_exc()
+            db_invoice.pdf_stale = True
+        
+        db.commit()
+        return db_invoice
+    except HTTPException:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"Error updating invoice: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error updating invoice: {str(e)}")
 
-@app.get("/api/invoices/{invoice_id}", response_model=InvoiceSchema)
-def get_invoice(invoice_id: int, db: Session = Depends(get_db)):
+@app.get("/api/invoices/{invoice_id}/revisions", response_model=List[InvoiceRevisionSchema])
+def list_invoice_revisions(invoice_id: int, db: Session = Depends(get_db)):
+    """PDF revisions uploaded for an invoice, oldest first"""
     invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    return invoice
+    return invoice.revisions
 
 @app.delete("/api/invoices/{invoice_id}")
 def delete_invoice(invoice_id: int, db: Session = Depends(get_db)):
@@ -269,83 +447,197 @@ def delete_invoice(invoice_id: int, db: Session = Depends(get_db)):
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Delete from Google Drive if folder exists (this will delete the folder and all contents)
+    # Delete from storage if folder exists (this will delete the folder and all contents)
     if invoice.drive_folder_id:
         try:
-            from google_drive import delete_from_drive
             # Delete the entire invoice folder (which contains the PDF and all attachments)
-            delete_from_drive(invoice.drive_folder_id)
+            get_storage().delete(invoice.drive_folder_id)
         except Exception as e:
             # Log error but don't fail - continue with database deletion
-            print(f"Warning: Could not delete folder from Google Drive: {e}")
+            print(f"Warning: Could not delete folder from storage: {e}")
     elif invoice.drive_file_id:
         # Fallback: delete just the PDF file if folder ID doesn't exist
         try:
-            from google_drive import delete_from_drive
-            delete_from_drive(invoice.drive_file_id)
+            get_storage().delete(invoice.drive_file_id)
         except Exception as e:
-            print(f"Warning: Could not delete file from Google Drive: {e}")
+            print(f"Warning: Could not delete file from storage: {e}")
     
     # Delete the invoice (line items will be cascade deleted)
     db.delete(invoice)
     db.commit()
     return {"message": "Invoice deleted successfully"}
 
+@app.get("/api/invoices/{invoice_id}/files", response_model=List[AttachmentSchema])
+def list_invoice_files(invoice_id: int, db: Session = Depends(get_db)):
+    """Files attached to an invoice, from the local index (no storage calls)"""
+    invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return invoice.attachments
+
 @app.post("/api/invoices/{invoice_id}/files")
-async def upload_invoice_file(
+def upload_invoice_file(
     invoice_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    """Upload a file attachment to an existing invoice"""
+    """Upload a file attachment to an existing invoice
+    
+    Files whose content is already attached to the invoice are not uploaded
+    again; the existing attachment is returned with "duplicate": true.
+    """
+    import hashlib
+    
     invoice = db.query(Invoice).filter(Invoice.id == invoice_id).first()
     if not invoice:
         raise HTTPException(status_code=404, detail="Invoice not found")
     
-    # Ensure invoice has a folder in Drive
+    # Read file content (a plain def: storage calls block, so FastAPI runs this in its threadpool)
+    file_content = file.file.read()
+    sha256 = hashlib.sha256(file_content).hexdigest()
+    
+    def response(attachment: Attachment, duplicate: bool):
+        return {
+            "message": "File already attached" if duplicate else "File uploaded successfully",
+            "file_id": attachment.drive_file_id,
+            "file_url": attachment.drive_file_url,
+            "filename": attachment.filename,
+            "attachment_id": attachment.id,
+            "duplicate": duplicate
+        }
+    
+    def existing_attachment():
+        return db.query(Attachment).filter(
+            Attachment.invoice_id == invoice_id,
+            Attachment.sha256 == sha256
+        ).first()
+    
+    existing = existing_attachment()
+    if existing:
+        return response(existing, True)
+    
+    storage = get_storage()
+    
+    # Ensure invoice has a folder in storage
     if not invoice.drive_folder_id:
         # Create folder if it doesn't exist
+        party = db.query(Party).filter(Party.id == invoice.party_id).first()
+        if not party:
+            raise HTTPException(status_code=404, detail="Party not found")
         try:
-            party = db.query(Party).filter(Party.id == invoice.party_id).first()
-            if not party:
-                raise HTTPException(status_code=404, detail="Party not found")
-            
-            from google_drive import get_credentials, get_or_create_folder
-            from googleapiclient.discovery import build
-            
-            creds = get_credentials()
-            service = build('drive', 'v3', credentials=creds)
-            
-            invoices_folder_id = get_or_create_folder(service, "Invoices")
-            client_folder_id = get_or_create_folder(service, party.company_name, invoices_folder_id)
-            invoice_folder_id = get_or_create_folder(service, invoice.invoice_number, client_folder_id)
-            
-            invoice.drive_folder_id = invoice_folder_id
+            invoice.drive_folder_id = storage.ensure_invoice_folder(party.company_name, invoice.invoice_number)
             db.commit()
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error creating invoice folder: {str(e)}")
     
-    # Read file content
-    file_content = await file.read()
-    
-    # Upload to Drive
+    # Upload to storage
     try:
-        file_id, file_url = upload_file_to_invoice_folder(
+        file_id, file_url = storage.put(
             invoice.drive_folder_id,
             file_content,
             file.filename,
             file.content_type
         )
-        return {
-            "message": "File uploaded successfully",
-            "file_id": file_id,
-            "file_url": file_url,
-            "filename": file.filename
-        }
     except Exception as e:
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error uploading file: {str(e)}")
+    
+    attachment = Attachment(
+        invoice_id=invoice_id,
+        filename=file.filename,
+        size=len(file_content),
+        mime_type=file.content_type,
+        sha256=sha256,
+        drive_file_id=file_id,
+        drive_file_url=file_url
+    )
+    db.add(attachment)
+    try:
+        db.commit()
+    except IntegrityError:
+        # The same content was attached concurrently: keep that one
+        db.rollback()
+        winner = existing_attachment()
+        # A retried put can return the file the other upload stored (see
+        # StorageBackend.put); never delete the file the kept row points to
+        if file_id != winner.drive_file_id:
+            try:
+                storage.delete(file_id)
+            except Exception as e:
+                print(f"Warning: Could not delete duplicate upload {file_id}: {e}")
+        return response(winner, True)
+    db.refresh(attachment)
+    return response(attachment, False)
+
+# Invoice template endpoints (recurring invoices, generated by scheduler.py)
+@app.get("/api/templates", response_model=List[InvoiceTemplateSchema])
+def list_templates(db: Session = Depends(get_db)):
+    # Templates left behind by parties deleted before templates were deleted with them
+    return db.query(InvoiceTemplate).filter(InvoiceTemplate.party.has()).order_by(InvoiceTemplate.id).all()
+
+@app.post("/api/templates", response_model=InvoiceTemplateSchema)
+def create_template(template: InvoiceTemplateCreate, db: Session = Depends(get_db)):
+    party = db.query(Party).filter(Party.id == template.party_id).first()
+    if not party:
+        raise HTTPException(status_code=404, detail="Party not found")
+    template_data = template.model_dump()
+    line_items_data = template_data.pop("line_items")
+    db_template = InvoiceTemplate(**template_data)
+    db_template.line_items = [TemplateLineItem(**item) for item in line_items_data]
+    db.add(db_template)
+    db.commit()
+    db.refresh(db_template)
+    return db_template
+
+@app.post("/api/templates/run")
+def run_templates(as_of: Optional[date] = None, db: Session = Depends(get_db)):
+    """Generate the invoices due from templates now (as of `as_of`, default today)
+    
+    The scheduler does this on its own; running it again creates nothing new.
+    """
+    try:
+        return scheduler.run_due(db, as_of)
+    except Exception as e:
+        import traceback
+        print(f"Error generating recurring invoices: {e}")
+        traceback.print_exc()
+        raise HTTPException(status_code=500, detail=f"Error generating recurring invoices: {str(e)}")
+
+@app.get("/api/templates/{template_id}", response_model=InvoiceTemplateSchema)
+def get_template(template_id: int, db: Session = Depends(get_db)):
+    template = db.query(InvoiceTemplate).filter(InvoiceTemplate.id == template_id).first()
+    if not template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    return template
+
+@app.put("/api/templates/{template_id}", response_model=InvoiceTemplateSchema)
+def update_template(template_id: int, template: InvoiceTemplateCreate, db: Session = Depends(get_db)):
+    """Update a template; invoices already generated from it are not changed"""
+    db_template = db.query(InvoiceTemplate).filter(InvoiceTemplate.id == template_id).first()
+    if not db_template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    if not db.query(Party).filter(Party.id == template.party_id).first():
+        raise HTTPException(status_code=404, detail="Party not found")
+    template_data = template.model_dump()
+    line_items_data = template_data.pop("line_items")
+    for key, value in template_data.items():
+        setattr(db_template, key, value)
+    db_template.line_items = [TemplateLineItem(**item) for item in line_items_data]
+    db.commit()
+    db.refresh(db_template)
+    return db_template
+
+@app.delete("/api/templates/{template_id}")
+def delete_template(template_id: int, db: Session = Depends(get_db)):
+    """Delete a template; invoices generated from it are kept"""
+    db_template = db.query(InvoiceTemplate).filter(InvoiceTemplate.id == template_id).first()
+    if not db_template:
+        raise HTTPException(status_code=404, detail="Template not found")
+    db.query(Invoice).filter(Invoice.template_id == template_id).update({Invoice.template_id: None})
+    db.delete(db_template)
+    db.commit()
+    return {"message": "Template deleted"}
 
 # Config endpoints
 @app.get("/api/config", response_model=ConfigSchema)
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, Text
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Text, Boolean, Index
+from datetime import datetime, timezone
 from sqlalchemy.orm import relationship
 from database import Base
 
@@ -14,6 +15,7 @@ class Party(Base):
     payment_term = Column(String, default="30 days")
     
     invoices = relationship("Invoice", back_populates="party")
+    templates = relationship("InvoiceTemplate", back_populates="party", cascade="all, delete-orphan")
 
 class Invoice(Base):
     __tablename__ = "invoices"
@@ -23,12 +25,24 @@ class Invoice(Base):
     date = Column(Date, nullable=False)
     party_id = Column(Integer, ForeignKey("parties.id"), nullable=False)
     payment_term = Column(String, default="30 days")
-    drive_file_id = Column(String)
+    drive_file_id = Column(String, index=True)
     drive_file_url = Column(String)
-    drive_folder_id = Column(String)  # Folder ID for invoice-specific folder containing PDF and attachments
+    drive_folder_id = Column(String, index=True)  # Folder ID for invoice-specific folder containing PDF and attachments
+    render_hash = Column(String)  # Hash of the inputs of the last uploaded PDF (see pdf_generator.render_hash)
+    pdf_stale = Column(Boolean, default=False, index=True)  # Edited, but the new PDF is not uploaded yet (scheduler.render_pending retries)
+    template_id = Column(Integer, ForeignKey("invoice_templates.id"), nullable=True)  # Set if generated from a template
+    template_period = Column(String, nullable=True)  # Period the template invoice covers, e.g. "2025-10"
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))  # Unknown for invoices created before this column
+    
+    # One invoice per template and period, so re-running the scheduler is harmless
+    __table_args__ = (Index("ix_invoices_template_period", "template_id", "template_period", unique=True),)
     
     party = relationship("Party", back_populates="invoices")
     line_items = relationship("LineItem", back_populates="invoice", cascade="all, delete-orphan")
+    revisions = relationship("InvoiceRevision", back_populates="invoice", cascade="all, delete-orphan",
+                             order_by="InvoiceRevision.revision")
+    attachments = relationship("Attachment", back_populates="invoice", cascade="all, delete-orphan",
+                               order_by="Attachment.id")
 
 class LineItem(Base):
     __tablename__ = "line_items"
@@ -43,6 +57,65 @@ class LineItem(Base):
     
     invoice = relationship("Invoice", back_populates="line_items")
 
+class InvoiceRevision(Base):
+    __tablename__ = "invoice_revisions"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False, index=True)
+    revision = Column(Integer, nullable=False)  # 1 for the PDF uploaded on creation
+    render_hash = Column(String, nullable=False)
+    drive_file_id = Column(String)
+    drive_revision_id = Column(String)  # Storage revision/version ID, if the backend reports one
+    changes = Column(Text)  # Summary of the edit, e.g. "2 updated, 1 added"
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    invoice = relationship("Invoice", back_populates="revisions")
+
+class Attachment(Base):
+    __tablename__ = "attachments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)  # Bytes
+    mime_type = Column(String)
+    sha256 = Column(String, nullable=False)  # Hex digest of the content
+    drive_file_id = Column(String, index=True)
+    drive_file_url = Column(String)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    # The same content is stored once per invoice
+    __table_args__ = (Index("ix_attachments_invoice_sha256", "invoice_id", "sha256", unique=True),)
+    
+    invoice = relationship("Invoice", back_populates="attachments")
+
+class InvoiceTemplate(Base):
+    __tablename__ = "invoice_templates"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    party_id = Column(Integer, ForeignKey("parties.id"), nullable=False)
+    name = Column(String, nullable=False)
+    frequency = Column(String, nullable=False, default="monthly")  # monthly, quarterly or yearly
+    start_date = Column(Date, nullable=False)  # First period to invoice is the one containing this date
+    end_date = Column(Date, nullable=True)  # No invoices for periods starting after this date
+    active = Column(Boolean, nullable=False, default=True)
+    
+    party = relationship("Party", back_populates="templates")
+    line_items = relationship("TemplateLineItem", back_populates="template", cascade="all, delete-orphan")
+
+class TemplateLineItem(Base):
+    __tablename__ = "template_line_items"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    template_id = Column(Integer, ForeignKey("invoice_templates.id"), nullable=False)
+    description = Column(String, nullable=False)
+    rate = Column(Float, nullable=False)
+    quantity = Column(Float, nullable=False)
+    unit = Column(String, default="days")
+    group_name = Column(String, nullable=True)
+    
+    template = relationship("InvoiceTemplate", back_populates="line_items")
+
 class Config(Base):
     __tablename__ = "config"
     
@@ -57,3 +130,10 @@ class Config(Base):
     bic = Column(String)
     vat_note = Column(String, default="VAT not applicable, Art. 293 B of the French Tax Code")
 
+class SyncState(Base):
+    __tablename__ = "sync_state"
+    
+    key = Column(String, primary_key=True)  # e.g. "drive:changes_token"
+    value = Column(Text)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc),
+                        onupdate=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,303 @@
+"""Direct PDF rendering with reportlab
+
+Draws the layout of templates/invoice.html straight onto a PDF canvas instead
+of running WeasyPrint's HTML/CSS layout. Time and memory stay roughly linear in
+the number of line items, which matters for long time-tracking invoices.
+
+Sizes below are the CSS values from the template converted to points
+(1px = 0.75pt). The table is paginated here: rows that don't fit start a new
+page, which repeats the table header, and the total/footer block is kept together.
+Like the template's fallback font, text uses the built-in Courier faces, so
+only characters in ENCODING are supported (pdf_generator.choose_engine keeps
+other invoices on the html engine unless direct is asked for explicitly).
+"""
+from io import BytesIO
+from typing import List, Tuple
+
+from reportlab.lib.colors import HexColor, black
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase.pdfmetrics import getAscent, getDescent, stringWidth
+from reportlab.pdfgen import canvas
+
+PX = 0.75
+PAGE_WIDTH, PAGE_HEIGHT = A4
+PADDING = 40 * PX
+CONTENT_WIDTH = PAGE_WIDTH - 2 * PADDING
+LINE_HEIGHT = 1.6
+
+FONT = "Courier"
+FONT_BOLD = "Courier-Bold"
+# WinAnsiEncoding, used by reportlab for the built-in fonts
+ENCODING = "cp1252"
+BASE_SIZE = 12 * PX
+
+CELL_PADDING = 10 * PX
+GROUP_PADDING = 8 * PX
+HEADER_BORDER = 2 * PX
+ROW_BORDER = 1 * PX
+ROW_BORDER_COLOR = HexColor("#dddddd")
+GROUP_BACKGROUND = HexColor("#f5f5f5")
+
+COLUMNS = ["DESCRIPTION", "RATE", "QTY", "UNIT", "TOTAL"]
+MIN_DESCRIPTION_WIDTH = CONTENT_WIDTH * 0.3
+
+class _Page:
+    """A canvas with a top-down cursor and page breaks"""
+
+    def __init__(self, pdf: canvas.Canvas):
+        self.pdf = pdf
+        self.y = PADDING  # distance from the top of the page
+        self.pages = 1
+
+    @property
+    def remaining(self) -> float:
+        return PAGE_HEIGHT - PADDING - self.y
+
+    def new_page(self):
+        self.pdf.showPage()
+        self.pages += 1
+        self.y = PADDING
+
+    def ensure(self, height: float) -> bool:
+        """Start a new page unless `height` fits; returns True if a page was added"""
+        if height > self.remaining and self.y > PADDING:
+            self.new_page()
+            return True
+        return False
+
+    def baseline(self, top: float, size: float) -> float:
+        """PDF y coordinate of the baseline for a line box starting at `top`"""
+        ascent = getAscent(FONT, size)
+        descent = -getDescent(FONT, size)
+        half_leading = (size * LINE_HEIGHT - (ascent + descent)) / 2
+        return PAGE_HEIGHT - (top + half_leading + ascent)
+
+    def text(self, text: str, size: float = BASE_SIZE, bold: bool = False, x: float = PADDING,
+             align: str = "left", top: float = None) -> float:
+        """Draw one line of text at `top` (default: the cursor). Returns the line height"""
+        top = self.y if top is None else top
+        self.pdf.setFont(FONT_BOLD if bold else FONT, size)
+        y = self.baseline(top, size)
+        if align == "right":
+            self.pdf.drawRightString(x, y, text)
+        elif align == "center":
+            self.pdf.drawCentredString(x, y, text)
+        else:
+            self.pdf.drawString(x, y, text)
+        return size * LINE_HEIGHT
+
+    def line(self, text: str, size: float = BASE_SIZE, bold: bool = False, x: float = PADDING, align: str = "left"):
+        """Draw a line of text at the cursor and move below it"""
+        self.y += self.text(text, size, bold, x, align)
+
+    def hline(self, top: float, width: float, color=black, x: float = PADDING):
+        self.pdf.setStrokeColor(color)
+        self.pdf.setLineWidth(width)
+        y = PAGE_HEIGHT - top - width / 2
+        self.pdf.line(x, y, x + CONTENT_WIDTH, y)
+
+def _row_cells(item: dict) -> List[str]:
+    return [item["description"], f"€{item['rate']}", item["quantity"], item["unit"] or "", f"€{item['total']}"]
+
+def _column_widths(rows: List[List[str]]) -> List[float]:
+    """Numeric columns are as wide as their widest cell; the description takes the rest"""
+    widths = []
+    for index, title in enumerate(COLUMNS[1:], start=1):
+        widest = max(
+            [stringWidth(title, FONT_BOLD, BASE_SIZE)]
+            + [stringWidth(row[index], FONT, BASE_SIZE) for row in rows]
+        )
+        widths.append(widest + 2 * CELL_PADDING)
+    description = max(MIN_DESCRIPTION_WIDTH, CONTENT_WIDTH - sum(widths))
+    # Very wide numbers shrink proportionally so the table stays on the page
+    scale = min(1.0, (CONTENT_WIDTH - description) / sum(widths))
+    return [description] + [w * scale for w in widths]
+
+def _draw_table_header(page: _Page, widths: List[float]):
+    row_height = BASE_SIZE * LINE_HEIGHT + 2 * CELL_PADDING
+    top = page.y + CELL_PADDING
+    x = PADDING
+    for index, (title, width) in enumerate(zip(COLUMNS, widths)):
+        if index == 0:
+            page.text(title, bold=True, x=x + CELL_PADDING, top=top)
+        else:
+            page.text(title, bold=True, x=x + width - CELL_PADDING, align="right", top=top)
+        x += width
+    page.y += row_height
+    page.hline(page.y, HEADER_BORDER)
+    page.y += HEADER_BORDER
+
+def _draw_group_header(page: _Page, name: str):
+    height = BASE_SIZE * LINE_HEIGHT + 2 * GROUP_PADDING
+    page.pdf.setFillColor(GROUP_BACKGROUND)
+    page.pdf.rect(PADDING, PAGE_HEIGHT - page.y - height, CONTENT_WIDTH, height, stroke=0, fill=1)
+    page.pdf.setFillColor(black)
+    page.text(name, bold=True, x=PADDING + CELL_PADDING, top=page.y + GROUP_PADDING)
+    page.y += height
+    page.hline(page.y, HEADER_BORDER)
+    page.y += HEADER_BORDER
+
+def _row_layout(cells: List[str], widths: List[float]) -> Tuple[List[str], float]:
+    lines = simpleSplit(cells[0], FONT, BASE_SIZE, widths[0] - 2 * CELL_PADDING) or [""]
+    return lines, len(lines) * BASE_SIZE * LINE_HEIGHT + 2 * CELL_PADDING + ROW_BORDER
+
+def _draw_row(page: _Page, cells: List[str], description_lines: List[str], height: float, widths: List[float]):
+    top = page.y + CELL_PADDING
+    for n, text in enumerate(description_lines):
+        page.text(text, x=PADDING + CELL_PADDING, top=top + n * BASE_SIZE * LINE_HEIGHT)
+    x = PADDING + widths[0]
+    for text, width in zip(cells[1:], widths[1:]):
+        page.text(text, x=x + width - CELL_PADDING, align="right", top=top)
+        x += width
+    page.y += height - ROW_BORDER
+    page.hline(page.y, ROW_BORDER, ROW_BORDER_COLOR)
+    page.y += ROW_BORDER
+
+def _draw_table(page: _Page, line_items: List[dict]):
+    # Flatten groups into (kind, payload) entries, in template order
+    entries = []
+    for item in line_items:
+        if item.get("is_group_header"):
+            entries.append(("group", item["group_name"]))
+            entries.extend(("row", _row_cells(sub_item)) for sub_item in item["items"])
+        else:
+            entries.append(("row", _row_cells(item)))
+
+    widths = _column_widths([payload for kind, payload in entries if kind == "row"])
+    group_height = BASE_SIZE * LINE_HEIGHT + 2 * GROUP_PADDING + HEADER_BORDER
+    header_height = BASE_SIZE * LINE_HEIGHT + 2 * CELL_PADDING + HEADER_BORDER
+
+    page.ensure(header_height + group_height)
+    _draw_table_header(page, widths)
+    for index, (kind, payload) in enumerate(entries):
+        if kind == "group":
+            # Keep a group header with its first row
+            following = entries[index + 1] if index + 1 < len(entries) else None
+            needed = group_height
+            if following and following[0] == "row":
+                needed += _row_layout(following[1], widths)[1]
+            if page.ensure(needed):
+                _draw_table_header(page, widths)
+            _draw_group_header(page, payload)
+        else:
+            lines, height = _row_layout(payload, widths)
+            if page.ensure(height):
+                _draw_table_header(page, widths)
+            _draw_row(page, payload, lines, height, widths)
+
+def _text_block_height(lines: int, size: float = BASE_SIZE) -> float:
+    return lines * size * LINE_HEIGHT
+
+def _wrap(text: str, width: float, size: float = BASE_SIZE, bold: bool = False) -> List[str]:
+    """`text` broken into lines that fit `width`, as the HTML template wraps it"""
+    return simpleSplit(text, FONT_BOLD if bold else FONT, size, width) or [""]
+
+def _footer_columns(config, payment_term) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    left = []
+    for title, value in (("SIRET", config.siret), ("PHONE", config.phone),
+                         ("EMAIL", config.email), ("POSTAL ADDRESS", config.address)):
+        if value:
+            left.append((title, value))
+    right = []
+    if config.iban or config.bic:
+        lines = []
+        if config.iban:
+            lines.append(f"IBAN: {config.iban}")
+        if config.bic:
+            lines.append(f"BIC: {config.bic}")
+        right.append(("PAYMENT BY BANK TRANSFER", "\n".join(lines)))
+    right.append(("PAYMENT TERM", payment_term or ""))
+    return left, right
+
+def _section_height(sections: List[Tuple[str, str]], width: float) -> float:
+    height = 0.0
+    for index, (_, value) in enumerate(sections):
+        paragraphs = value.split("\n")
+        lines = sum(len(_wrap(paragraph, width)) for paragraph in paragraphs)
+        height += (12 * PX if index else 0) + _text_block_height(1) + 10 * PX
+        height += _text_block_height(lines) + 3 * PX * (len(paragraphs) - 1)
+    return height
+
+def _draw_sections(page: _Page, sections: List[Tuple[str, str]], x: float, top: float, width: float):
+    for index, (title, value) in enumerate(sections):
+        if index:
+            top += 12 * PX
+        top += page.text(title, bold=True, x=x, top=top) + 10 * PX
+        for n, paragraph in enumerate(value.split("\n")):
+            if n:
+                top += 3 * PX
+            for text in _wrap(paragraph, width):
+                top += page.text(text, x=x, top=top)
+
+def _draw_totals_and_footer(page: _Page, context: dict):
+    config = context["config"]
+    left, right = _footer_columns(config, context["payment_term"])
+    column_width = (CONTENT_WIDTH - 30 * PX) / 2
+    legal_name_lines = _wrap(config.legal_name or "", column_width, 16 * PX, bold=True)
+    legal_name_height = _text_block_height(len(legal_name_lines), 16 * PX) + 15 * PX
+    footer_height = max(legal_name_height + (12 * PX if left else 0) + _section_height(left, column_width),
+                        _section_height(right, column_width))
+    vat_height = (30 * PX + 10 * PX * LINE_HEIGHT) if config.vat_note else 0
+    totals_height = 30 * PX + 18 * PX * LINE_HEIGHT + 10 * PX + 20 * PX * LINE_HEIGHT
+    page.ensure(totals_height + 50 * PX + footer_height + vat_height)
+
+    # Total
+    right_edge = PADDING + CONTENT_WIDTH
+    page.y += 30 * PX
+    page.line("TOTAL", size=18 * PX, bold=True, x=right_edge, align="right")
+    page.y += 10 * PX
+    page.line(f"€ {context['total']}", size=20 * PX, bold=True, x=right_edge, align="right")
+
+    # Footer: two grid columns
+    page.y += 50 * PX
+    top = page.y
+    for n, text in enumerate(legal_name_lines):
+        page.text(text, size=16 * PX, bold=True, top=top + _text_block_height(n, 16 * PX))
+    _draw_sections(page, left, PADDING, top + legal_name_height + 12 * PX, column_width)
+    _draw_sections(page, right, PADDING + column_width + 30 * PX, top, column_width)
+    page.y += footer_height
+
+    if config.vat_note:
+        page.y += 30 * PX
+        page.line(config.vat_note, size=10 * PX, x=PAGE_WIDTH / 2, align="center")
+
+def render_pdf(context: dict) -> bytes:
+    """Render an invoice PDF from a context built by pdf_generator.build_context"""
+    buffer = BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    pdf.setTitle(f"Invoice {context['invoice_number']}")
+    page = _Page(pdf)
+    party = context["party"]
+    right_edge = PADDING + CONTENT_WIDTH
+
+    # Header: brand name, then invoice number and date on the right
+    page.line(context["brand_name"] or "", size=24 * PX, bold=True)
+    page.y += 30 * PX
+    for title, value in (("INVOICE #", context["invoice_number"]), ("DATE", context["date"])):
+        page.y += 5 * PX
+        page.line(title, bold=True, x=right_edge, align="right")
+        page.y += 5 * PX
+        page.line(value, x=right_edge, align="right")
+    page.y += 5 * PX + 40 * PX
+
+    # Issued to
+    page.line("ISSUED TO", bold=True)
+    page.y += 10 * PX
+    party_lines = [party.company_name]
+    if party.contact_person:
+        party_lines.append(f"To the attention of {party.contact_person}")
+    party_lines.extend(value for value in (party.address, party.city, party.vat_number) if value)
+    for n, value in enumerate(party_lines):
+        if n:
+            page.y += 3 * PX
+        for text in _wrap(value or "", CONTENT_WIDTH):
+            page.line(text)
+    page.y += 30 * PX
+
+    _draw_table(page, context["line_items"])
+    _draw_totals_and_footer(page, context)
+
+    pdf.showPage()
+    pdf.save()
+    return buffer.getvalue()
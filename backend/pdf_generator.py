@@ -1,12 +1,35 @@
 from jinja2 import Template
-from weasyprint import HTML
 from io import BytesIO
+import hashlib
+import json
 import os
 from models import Invoice, Party, Config, LineItem
-from typing import List
+from typing import List, Optional
 
-def generate_pdf(invoice: Invoice, party: Party, config: Config, line_items: List[LineItem]) -> bytes:
-    """Generate PDF invoice from template"""
+# Rendering engines: "html" lays out templates/invoice.html with WeasyPrint,
+# "direct" draws the same layout with reportlab (see pdf_direct.py), which is
+# much faster and lighter for invoices with many line items.
+PDF_ENGINES = ("html", "direct")
+
+def choose_engine(engine: Optional[str], line_item_count: int, context: Optional[dict] = None) -> str:
+    """Resolve the engine to use: explicit choice, else PDF_ENGINE, else by line item count
+
+    With engine "auto" (the default), invoices with at least PDF_DIRECT_THRESHOLD
+    line items (default 100) use the direct engine, unless the rendering
+    `context` (from build_context) has text its fonts can't draw.
+    """
+    engine = (engine or os.environ.get("PDF_ENGINE") or "auto").lower()
+    if engine == "auto":
+        threshold = int(os.environ.get("PDF_DIRECT_THRESHOLD", "100"))
+        if line_item_count < threshold:
+            return "html"
+        return "direct" if context is None or direct_can_render(context) else "html"
+    if engine not in PDF_ENGINES:
+        raise ValueError(f"Unknown PDF engine '{engine}'. Expected one of: auto, {', '.join(PDF_ENGINES)}")
+    return engine
+
+def build_context(invoice: Invoice, party: Party, config: Config, line_items: List[LineItem]) -> dict:
+    """Format invoice data for rendering (shared by both engines)"""
     
     # Calculate total
     total = sum(item.rate * item.quantity for item in line_items)
@@ -52,28 +75,87 @@ def generate_pdf(invoice: Invoice, party: Party, config: Config, line_items: Lis
     # Format total
     formatted_total = f"{total:,.2f}".replace(",", " ")
     
-    # Load template
+    return {
+        'brand_name': config.brand_name,
+        'invoice_number': invoice.invoice_number,
+        'date': formatted_date,
+        'party': party,
+        'line_items': formatted_line_items,
+        'total': formatted_total,
+        'config': config,
+        'payment_term': invoice.payment_term,
+    }
+
+PARTY_FIELDS = ("company_name", "contact_person", "address", "city", "vat_number")
+CONFIG_FIELDS = ("brand_name", "legal_name", "siret", "phone", "email", "address", "iban", "bic", "vat_note")
+
+def _printed_text(context: dict):
+    for key in ("brand_name", "invoice_number", "date", "total", "payment_term"):
+        yield context[key]
+    for field in PARTY_FIELDS:
+        yield getattr(context["party"], field)
+    for field in CONFIG_FIELDS:
+        yield getattr(context["config"], field)
+    for entry in context["line_items"]:
+        if entry.get("is_group_header"):
+            yield entry["group_name"]
+        for item in entry.get("items", [entry]):
+            yield item["description"]
+            yield item["unit"]
+
+def direct_can_render(context: dict) -> bool:
+    """Whether the direct engine's built-in fonts have every character of the invoice
+    
+    Other text (e.g. "Łódź", "東京") would come out as empty boxes.
+    """
+    from pdf_direct import ENCODING
+    try:
+        for text in _printed_text(context):
+            if text:
+                text.encode(ENCODING)
+    except UnicodeEncodeError:
+        return False
+    return True
+
+def render_hash(invoice: Invoice, party: Party, config: Config, line_items: List[LineItem]) -> str:
+    """Hash of everything that appears on the rendered PDF
+    
+    Two invoices with the same hash render to the same document, so an edit that
+    leaves it unchanged does not need a new PDF.
+    """
+    context = build_context(invoice, party, config, line_items)
+    context["party"] = {field: getattr(party, field) for field in PARTY_FIELDS}
+    context["config"] = {field: getattr(config, field) for field in CONFIG_FIELDS}
+    payload = json.dumps(context, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def render_html(context: dict) -> str:
+    """Render templates/invoice.html with a context from build_context"""
     template_path = os.path.join(os.path.dirname(__file__), "templates", "invoice.html")
     with open(template_path, "r") as f:
         template_content = f.read()
     
     template = Template(template_content)
+    return template.render(**context)
+
+def generate_pdf(invoice: Invoice, party: Party, config: Config, line_items: List[LineItem],
+                 engine: Optional[str] = None) -> bytes:
+    """Generate PDF invoice from template
+
+    `engine` is "html", "direct" or "auto" (see choose_engine).
+    """
+    context = build_context(invoice, party, config, line_items)
+    
+    if choose_engine(engine, len(line_items), context) == "direct":
+        from pdf_direct import render_pdf
+        return render_pdf(context)
     
     # Render template with data
-    html_content = template.render(
-        brand_name=config.brand_name,
-        invoice_number=invoice.invoice_number,
-        date=formatted_date,
-        party=party,
-        line_items=formatted_line_items,
-        total=formatted_total,
-        config=config,
-        payment_term=invoice.payment_term
-    )
-    
-    # Generate PDF
+    html_content = render_html(context)
+    
+    # Generate PDF (WeasyPrint is imported here because it is slow to load)
+    from weasyprint import HTML
     html = HTML(string=html_content)
     pdf_bytes = html.write_pdf()
     
     return pdf_bytes
-
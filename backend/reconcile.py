@@ -0,0 +1,238 @@
+"""Reconciliation between the database and storage (Google Drive by default)
+
+A pass brings the drive_* IDs in the database back in line with storage:
+1. Find the files and folders removed from storage. Normally this reads the
+   storage change feed (Drive's Changes API) from the page token saved by the
+   previous pass, so the cost depends on what changed, not on how many
+   invoices exist. The first pass, a pass with full=True, and backends
+   without a change feed check every known ID instead.
+2. Clear the IDs of removed invoice files and folders, and drop attachments
+   whose file is gone.
+3. Re-queue invoices without a PDF (failed uploads, or cleared in step 2) and
+   edited invoices whose new PDF failed to upload (pdf_stale): they are
+   rendered and uploaded again through scheduler.render_pending.
+
+The report of the last pass ("drift") is kept in the database and served by
+GET /api/reconcile. The background thread started by start_reconciler() runs a
+pass every RECONCILE_INTERVAL seconds (default 900) in one worker process.
+
+Environment:
+    RECONCILE=0            disable the background reconciliation
+    RECONCILE_INTERVAL     seconds between passes (default 900)
+    RECONCILE_GRACE        seconds a new invoice's own upload may take before
+                           it is re-queued (default 300)
+"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy.orm import Session
+
+from models import Attachment, Invoice, SyncState
+
+REPORT_KEY = "reconcile:last_report"
+# Bound the size of IN (...) lists
+CHUNK_SIZE = 500
+
+def _token_key(storage) -> str:
+    return f"{storage.name}:changes_token"
+
+def _get_state(db: Session, key: str) -> Optional[str]:
+    state = db.query(SyncState).filter(SyncState.key == key).first()
+    return state.value if state else None
+
+def _set_state(db: Session, key: str, value: str):
+    state = db.query(SyncState).filter(SyncState.key == key).first()
+    if state:
+        state.value = value
+    else:
+        db.add(SyncState(key=key, value=value))
+
+def _chunks(ids: Iterable[str]) -> Iterable[List[str]]:
+    ids = list(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+def _known_ids(db: Session, ids: Set[str]) -> Set[str]:
+    """The subset of `ids` referenced by an invoice or attachment"""
+    known = set()
+    for chunk in _chunks(ids):
+        known.update(i for (i,) in db.query(Invoice.drive_file_id).filter(Invoice.drive_file_id.in_(chunk)))
+        known.update(i for (i,) in db.query(Invoice.drive_folder_id).filter(Invoice.drive_folder_id.in_(chunk)))
+        known.update(i for (i,) in db.query(Attachment.drive_file_id).filter(Attachment.drive_file_id.in_(chunk)))
+    return known
+
+def _all_ids(db: Session) -> Set[str]:
+    ids = set()
+    for column in (Invoice.drive_file_id, Invoice.drive_folder_id, Attachment.drive_file_id):
+        ids.update(i for (i,) in db.query(column).filter(column.isnot(None)).distinct())
+    return ids
+
+def _full_check(db: Session, storage, report: Dict) -> Set[str]:
+    ids = sorted(_all_ids(db))
+    removed = set()
+    for item_id, exists in zip(ids, storage.batch([("exists", (i,)) for i in ids])):
+        if isinstance(exists, Exception):
+            # Unknown state: leave the ID alone, the next full check retries it
+            report["check_errors"] += 1
+        elif not exists:
+            removed.add(item_id)
+    report["checked"] = len(ids)
+    return removed
+
+def find_removed(db: Session, storage, report: Dict, full: bool = False) -> Tuple[Set[str], Optional[str]]:
+    """IDs removed from storage, and the change token to save once they are handled"""
+    token = _get_state(db, _token_key(storage))
+    if storage.supports_changes and token and not full:
+        changes, next_token = storage.list_changes(token)
+        report["changes"] = len(changes)
+        removed = {change["id"] for change in changes if change["removed"]}
+        known = _known_ids(db, removed)
+        # Removing a client (or the root) folder takes our files with it,
+        # but the feed may only report the folder itself
+        if not any(change["folder"] and change["id"] not in known for change in changes if change["removed"]):
+            report["mode"] = "changes"
+            return removed & known, next_token
+        report["mode"] = "full (unknown folder removed)"
+    else:
+        report["mode"] = "full"
+
+    # Take the token first, so changes made during the check are seen next time
+    next_token = storage.changes_start_token() if storage.supports_changes else None
+    return _full_check(db, storage, report), next_token
+
+def clear_removed(db: Session, removed: Set[str], report: Dict):
+    """Clear database references to files and folders removed from storage"""
+    for chunk in _chunks(removed):
+        # A removed invoice folder takes the PDF and the attachments with it
+        for invoice in db.query(Invoice).filter(Invoice.drive_folder_id.in_(chunk)):
+            invoice.drive_folder_id = None
+            if invoice.drive_file_id:
+                invoice.drive_file_id = None
+                invoice.drive_file_url = None
+                report["cleared_files"] += 1
+            report["removed_attachments"] += len(invoice.attachments)
+            invoice.attachments = []
+            report["cleared_folders"] += 1
+        db.flush()
+        for invoice in db.query(Invoice).filter(Invoice.drive_file_id.in_(chunk)):
+            invoice.drive_file_id = None
+            invoice.drive_file_url = None
+            report["cleared_files"] += 1
+        for attachment in db.query(Attachment).filter(Attachment.drive_file_id.in_(chunk)):
+            db.delete(attachment)
+            report["removed_attachments"] += 1
+
+def reconcile(db: Session, storage=None, full: bool = False) -> Dict:
+    """Run one reconciliation pass and return its report"""
+    from coordination import exclusive
+    from scheduler import render_pending
+    from storage import get_storage
+
+    storage = storage or get_storage()
+    started = time.perf_counter()
+    report = {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "storage": storage.name,
+        "mode": None,
+        "changes": 0,
+        "checked": 0,
+        "check_errors": 0,
+        "cleared_files": 0,
+        "cleared_folders": 0,
+        "removed_attachments": 0,
+        "missing_uploads": 0,
+        "stale_pdfs": 0,
+        "requeued": 0,
+        "uploaded": 0,
+        "failed": 0,
+    }
+    with exclusive("reconcile"):
+        removed, next_token = find_removed(db, storage, report, full)
+        # Invoices whose upload failed (as opposed to files removed from storage)
+        report["missing_uploads"] = db.query(Invoice).filter(Invoice.drive_file_id.is_(None)).count()
+        clear_removed(db, removed, report)
+        if next_token is not None:
+            _set_state(db, _token_key(storage), next_token)
+        db.commit()
+        # Edits whose upload failed, on files still in storage
+        report["stale_pdfs"] = db.query(Invoice).filter(
+            Invoice.drive_file_id.isnot(None), Invoice.pdf_stale.is_(True)
+        ).count()
+
+        report["requeued"] = report["missing_uploads"] + report["stale_pdfs"] + report["cleared_files"]
+        if report["requeued"]:
+            grace = float(os.environ.get("RECONCILE_GRACE", "300"))
+            counts = render_pending(
+                db, storage, templates_only=False,
+                created_before=datetime.now(timezone.utc) - timedelta(seconds=grace)
+            )
+            report.update(counts)
+
+        report["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        report["drift"] = (report["cleared_files"] + report["cleared_folders"]
+                           + report["removed_attachments"] + report["missing_uploads"] + report["stale_pdfs"])
+        _set_state(db, REPORT_KEY, json.dumps(report))
+        db.commit()
+
+    if report["drift"]:
+        print(f"Reconcile ({report['mode']}): {report['cleared_files']} files and {report['cleared_folders']} folders "
+              f"missing from {storage.name}, {report['removed_attachments']} attachments removed, "
+              f"{report['missing_uploads']} uploads missing, {report['stale_pdfs']} stale PDFs, {report['uploaded']} of {report['requeued']} re-uploads done")
+    return report
+
+def last_report(db: Session) -> Optional[Dict]:
+    """Report of the last pass, if any"""
+    value = _get_state(db, REPORT_KEY)
+    return json.loads(value) if value else None
+
+def reset_changes_token(db: Session, storage=None):
+    """Track changes from now on, without checking the IDs already stored
+
+    For when the database is known to match storage (e.g. right after a
+    restore), to skip the full check of the next pass.
+    """
+    from storage import get_storage
+
+    storage = storage or get_storage()
+    if storage.supports_changes:
+        _set_state(db, _token_key(storage), storage.changes_start_token())
+        db.commit()
+
+_stop = threading.Event()
+_thread = None
+
+def _run_pass():
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        reconcile(db)
+    finally:
+        db.close()
+
+def start_reconciler() -> Optional[threading.Thread]:
+    """Start periodic reconciliation in the background (unless RECONCILE=0)"""
+    from coordination import run_as_leader
+
+    global _thread
+    if os.environ.get("RECONCILE", "1") in ("", "0", "false"):
+        return None
+    if _thread and _thread.is_alive():
+        return _thread
+    _stop.clear()
+    interval = float(os.environ.get("RECONCILE_INTERVAL", "900"))
+    _thread = threading.Thread(
+        target=run_as_leader,
+        args=("reconcile", _run_pass, lambda: interval, _stop),
+        name="storage-reconcile",
+        daemon=True
+    )
+    _thread.start()
+    return _thread
+
+def stop_reconciler():
+    _stop.set()
@@ -0,0 +1,313 @@
+"""Recurring invoices: generate the invoices due from invoice templates
+
+run_due() does one pass for all templates at once:
+1. Under the invoice number allocation lock, find the active templates without
+   an invoice for the current period (or for a period missed since the last
+   pass), allocate their numbers and insert all the invoices in a single
+   transaction.
+2. Render and upload every template invoice that has no PDF yet through a
+   bounded thread pool, recording each upload as it completes.
+
+Invoices are unique per (template, period), so running again (after a restart,
+from another worker, or by hand) creates nothing new and only retries uploads
+that failed. The background thread started by start_scheduler() runs a pass at
+start-up and then periodically, in one worker process only.
+
+Environment:
+    SCHEDULER=0                 disable the background scheduler
+    SCHEDULER_INTERVAL          seconds between passes (default 3600; a pass also runs just after midnight)
+    SCHEDULER_WORKERS           concurrent renders/uploads (default 4)
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload
+
+from models import Invoice, InvoiceRevision, InvoiceTemplate, LineItem, Config, SyncState
+
+FREQUENCY_MONTHS = {"monthly": 1, "quarterly": 3, "yearly": 12}
+# Date of the last pass (see due_templates)
+LAST_RUN_KEY = "scheduler:last_run"
+
+def period_start(frequency: str, day: date) -> date:
+    """First day of the period of `frequency` that contains `day`"""
+    months = FREQUENCY_MONTHS[frequency]
+    return date(day.year, (day.month - 1) // months * months + 1, 1)
+
+def period_label(frequency: str, start: date) -> str:
+    """Period name stored on generated invoices: 2025-10, 2025-Q4 or 2025"""
+    if frequency == "yearly":
+        return str(start.year)
+    if frequency == "quarterly":
+        return f"{start.year}-Q{(start.month - 1) // 3 + 1}"
+    return start.strftime("%Y-%m")
+
+def _periods(frequency: str, first: date, last: date) -> List[date]:
+    """Start of each period of `frequency` from the one containing `first` to the one containing `last`"""
+    months = FREQUENCY_MONTHS[frequency]
+    start, end = period_start(frequency, first), period_start(frequency, last)
+    periods = []
+    while start <= end:
+        periods.append(start)
+        month = start.month - 1 + months
+        start = date(start.year + month // 12, month % 12 + 1, 1)
+    return periods
+
+def due_templates(db: Session, today: date, since: Optional[date] = None) -> List[Tuple[InvoiceTemplate, str]]:
+    """(template, period) for each period without an invoice, oldest first
+
+    Covers the current period and, to catch up after the scheduler did not
+    run (server down, SCHEDULER=0), every period after the one containing
+    `since`, the date of the last pass. That pass handled its own period, so
+    periods a template was paused for are not invoiced afterwards.
+    """
+    templates = db.query(InvoiceTemplate).options(
+        joinedload(InvoiceTemplate.party),
+        joinedload(InvoiceTemplate.line_items)
+    ).filter(InvoiceTemplate.active.is_(True)).all()
+
+    since = min(since or today, today)
+    periods = {}
+    for t in templates:
+        periods[t.id] = _periods(t.frequency, max(since, t.start_date), today)
+        if since > t.start_date and len(periods[t.id]) > 1:
+            periods[t.id] = periods[t.id][1:]
+    labels = {period_label(t.frequency, start) for t in templates for start in periods[t.id]}
+    existing = set(db.query(Invoice.template_id, Invoice.template_period).filter(
+        Invoice.template_period.in_(labels)
+    ).all())
+
+    due = []
+    for template in templates:
+        if template.party is None:
+            # Its party was deleted (before templates were deleted with it)
+            print(f"Scheduler: template {template.id} ({template.name}) has no party, skipped")
+            continue
+        if today < template.start_date:
+            continue
+        missed = []
+        for start in periods[template.id]:
+            label = period_label(template.frequency, start)
+            if template.end_date and start > template.end_date:
+                break
+            if (template.id, label) not in existing:
+                missed.append((start, template, label))
+        if len(missed) > 1:
+            print(f"Scheduler: catching up {len(missed)} periods of template {template.id} ({template.name})")
+        due.extend(missed)
+    # Numbers are allocated in this order, so older periods get lower numbers
+    due.sort(key=lambda entry: (entry[0], entry[1].id))
+    return [(template, label) for _, template, label in due]
+
+def create_due_invoices(db: Session, today: Optional[date] = None) -> List[int]:
+    """Insert the invoices due today in one transaction. Returns their IDs"""
+    from invoice_numbers import allocation_lock, next_invoice_numbers
+
+    today = today or date.today()
+    with allocation_lock(db):
+        state = db.query(SyncState).filter(SyncState.key == LAST_RUN_KEY).first()
+        since = date.fromisoformat(state.value) if state else None
+        due = due_templates(db, today, since)
+        # Saved with the invoices, so a failed pass is caught up next time
+        if not state:
+            state = SyncState(key=LAST_RUN_KEY)
+            db.add(state)
+        state.value = max(today, since or today).isoformat()
+        if not due:
+            db.commit()
+            return []
+
+        # Dated on the day they are generated (normally the first day of the
+        # period), so numbers stay in chronological order
+        numbers = next_invoice_numbers(db, len(due), today=today)
+        invoices = []
+        for (template, period), invoice_number in zip(due, numbers):
+            invoices.append(Invoice(
+                invoice_number=invoice_number,
+                date=today,
+                party_id=template.party_id,
+                payment_term=template.party.payment_term or "30 days",
+                template_id=template.id,
+                template_period=period,
+                line_items=[
+                    LineItem(
+                        description=item.description,
+                        rate=item.rate,
+                        quantity=item.quantity,
+                        unit=item.unit,
+                        group_name=item.group_name
+                    )
+                    for item in template.line_items
+                ]
+            ))
+        db.add_all(invoices)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another process generated this period's invoices first
+            db.rollback()
+            return []
+        return [invoice.id for invoice in invoices]
+
+def render_pending(db: Session, storage=None, workers: Optional[int] = None,
+                   templates_only: bool = True, created_before: Optional[datetime] = None) -> Dict[str, int]:
+    """Render and upload invoices that have no PDF yet, or whose edit was not uploaded (pdf_stale)
+
+    Covers template invoices only unless `templates_only` is False (as used by
+    reconcile.py); `created_before` skips never-uploaded invoices created since
+    then, whose request may still be uploading them. PDFs are rendered and uploaded by up
+    to `workers` threads; each result is committed as soon as it arrives, so an
+    interrupted pass only redoes the invoices it had not finished.
+    """
+    from coordination import exclusive
+
+    # One pass at a time across processes, so no invoice is uploaded twice
+    with exclusive("pending-uploads"):
+        return _render_pending(db, storage, workers, templates_only, created_before)
+
+def _render_pending(db, storage, workers, templates_only, created_before):
+    from pdf_generator import generate_pdf, render_hash
+    from storage import ROOT_FOLDER_NAME, get_storage
+
+    storage = storage or get_storage()
+    workers = workers or int(os.environ.get("SCHEDULER_WORKERS", "4"))
+    query = db.query(Invoice).options(
+        joinedload(Invoice.party),
+        joinedload(Invoice.line_items)
+    ).filter(or_(Invoice.drive_file_id.is_(None), Invoice.pdf_stale.is_(True)))
+    if templates_only:
+        query = query.filter(Invoice.template_id.isnot(None))
+    if created_before:
+        # render_hash is only set by a successful upload
+        query = query.filter(or_(
+            Invoice.render_hash.isnot(None),
+            Invoice.created_at.is_(None),
+            Invoice.created_at < created_before
+        ))
+    invoices = query.all()
+    if not invoices:
+        return {"uploaded": 0, "failed": 0}
+
+    config = db.query(Config).first()
+    if not config:
+        print("Scheduler: business config not set, template invoices not rendered yet")
+        return {"uploaded": 0, "failed": len(invoices)}
+
+    # Shared parent folders are created once, up front, so the pool's threads
+    # don't race to create duplicates of them
+    try:
+        root_id = storage.ensure_folder(ROOT_FOLDER_NAME)
+        client_folders = {}
+        for invoice in invoices:
+            name = invoice.party.company_name
+            if name not in client_folders and not invoice.drive_file_id:
+                client_folders[name] = storage.ensure_folder(name, root_id)
+    except Exception as e:
+        print(f"Scheduler: could not prepare storage folders: {e}")
+        return {"uploaded": 0, "failed": len(invoices)}
+
+    def render_and_upload(invoice):
+        line_items = list(invoice.line_items)
+        pdf_bytes = generate_pdf(invoice, invoice.party, config, line_items)
+        filename = f"invoice_{invoice.invoice_number}.pdf"
+        revision_id = None
+        if invoice.drive_file_id:
+            # An edit whose upload failed: new revision of the existing file
+            file_id, file_url, revision_id = storage.update(invoice.drive_file_id, pdf_bytes, filename, "application/pdf")
+            folder_id = invoice.drive_folder_id
+        else:
+            folder_id = storage.ensure_folder(invoice.invoice_number, client_folders[invoice.party.company_name])
+            file_id, file_url = storage.put(folder_id, pdf_bytes, filename, "application/pdf")
+        return file_id, file_url, folder_id, revision_id, render_hash(invoice, invoice.party, config, line_items)
+
+    counts = {"uploaded": 0, "failed": 0}
+    # Committing must not expire the invoices the pool is still reading
+    expire_on_commit, db.expire_on_commit = db.expire_on_commit, False
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(render_and_upload, invoice): invoice for invoice in invoices}
+            for future in as_completed(futures):
+                invoice = futures[future]
+                try:
+                    file_id, file_url, folder_id, revision_id, content_hash = future.result()
+                except Exception as e:
+                    # Left as it was (no PDF, or stale); the next pass retries it
+                    print(f"Scheduler: error rendering/uploading invoice {invoice.invoice_number}: {e}")
+                    counts["failed"] += 1
+                    continue
+                invoice.drive_file_id = file_id
+                invoice.drive_file_url = file_url
+                invoice.drive_folder_id = folder_id
+                invoice.render_hash = content_hash
+                invoice.pdf_stale = False
+                # Re-uploads after the file went missing continue the history
+                last_revision = db.query(func.max(InvoiceRevision.revision)).filter(
+                    InvoiceRevision.invoice_id == invoice.id
+                ).scalar()
+                db.add(InvoiceRevision(
+                    invoice_id=invoice.id,
+                    revision=(last_revision or 0) + 1,
+                    render_hash=content_hash,
+                    drive_file_id=file_id,
+                    drive_revision_id=revision_id
+                ))
+                db.commit()
+                counts["uploaded"] += 1
+    finally:
+        db.expire_on_commit = expire_on_commit
+    return counts
+
+def run_due(db: Session, today: Optional[date] = None, storage=None) -> Dict[str, object]:
+    """Generate, render and upload all invoices due from templates"""
+    today = today or date.today()
+    created = create_due_invoices(db, today)
+    counts = render_pending(db, storage)
+    if created or counts["uploaded"] or counts["failed"]:
+        print(f"Scheduler: {len(created)} invoices created, {counts['uploaded']} uploaded, {counts['failed']} failed")
+    return {"date": today.isoformat(), "created": len(created), "invoice_ids": created, **counts}
+
+_stop = threading.Event()
+_thread = None
+
+def _seconds_until_next_pass(interval: float) -> float:
+    # Wake up just after midnight too, so new periods start on time
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return min(interval, (midnight - now).total_seconds() + 1)
+
+def _run_pass():
+    from database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        run_due(db)
+    finally:
+        db.close()
+
+def start_scheduler() -> Optional[threading.Thread]:
+    """Start the background scheduler thread (unless SCHEDULER=0)"""
+    from coordination import run_as_leader
+
+    global _thread
+    if os.environ.get("SCHEDULER", "1") in ("", "0", "false"):
+        return None
+    if _thread and _thread.is_alive():
+        return _thread
+    _stop.clear()
+    interval = float(os.environ.get("SCHEDULER_INTERVAL", "3600"))
+    _thread = threading.Thread(
+        target=run_as_leader,
+        args=("scheduler", _run_pass, lambda: _seconds_until_next_pass(interval), _stop),
+        name="invoice-scheduler",
+        daemon=True
+    )
+    _thread.start()
+    return _thread
+
+def stop_scheduler():
+    _stop.set()
@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from datetime import date
-from typing import List, Optional
+from datetime import date, datetime
+from typing import List, Literal, Optional
 
 # Party schemas
 class PartyBase(BaseModel):
@@ -31,6 +31,9 @@ class LineItemBase(BaseModel):
 class LineItemCreate(LineItemBase):
     pass
 
+class LineItemUpdate(LineItemBase):
+    id: Optional[int] = None  # Existing line item to update; omit to add a new one
+
 class LineItem(LineItemBase):
     id: int
     invoice_id: int
@@ -46,18 +49,84 @@ class InvoiceBase(BaseModel):
     payment_term: str = "30 days"
 
 class InvoiceCreate(BaseModel):
-    invoice_number: str
+    invoice_number: Optional[str] = None  # Allocated by the server if omitted
     date: date
     party_id: int
     line_items: List[LineItemCreate]
 
+class InvoiceUpdate(BaseModel):
+    invoice_number: str
+    date: date
+    party_id: int
+    line_items: List[LineItemUpdate]
+
+class InvoiceRevision(BaseModel):
+    id: int
+    invoice_id: int
+    revision: int
+    render_hash: str
+    drive_file_id: Optional[str] = None
+    drive_revision_id: Optional[str] = None
+    changes: Optional[str] = None
+    created_at: datetime
+    
+    class Config:
+        from_attributes = True
+
+class AttachmentSummary(BaseModel):
+    id: int
+    filename: str
+    size: int
+    mime_type: Optional[str] = None
+    drive_file_url: Optional[str] = None
+    
+    class Config:
+        from_attributes = True
+
+class Attachment(AttachmentSummary):
+    invoice_id: int
+    sha256: str
+    drive_file_id: Optional[str] = None
+    created_at: datetime
+
 class Invoice(InvoiceBase):
     id: int
     drive_file_id: Optional[str] = None
     drive_file_url: Optional[str] = None
     drive_folder_id: Optional[str] = None
+    pdf_stale: bool = False
+    template_id: Optional[int] = None
+    template_period: Optional[str] = None
     party: Party
     line_items: List[LineItem]
+    attachments: List[AttachmentSummary] = []
+    
+    class Config:
+        from_attributes = True
+
+# Invoice template schemas (recurring invoices)
+class TemplateLineItem(LineItemBase):
+    id: int
+    template_id: int
+    
+    class Config:
+        from_attributes = True
+
+class InvoiceTemplateBase(BaseModel):
+    party_id: int
+    name: str
+    frequency: Literal["monthly", "quarterly", "yearly"] = "monthly"
+    start_date: date
+    end_date: Optional[date] = None
+    active: bool = True
+
+class InvoiceTemplateCreate(InvoiceTemplateBase):
+    line_items: List[LineItemCreate]
+
+class InvoiceTemplate(InvoiceTemplateBase):
+    id: int
+    party: Party
+    line_items: List[TemplateLineItem]
     
     class Config:
         from_attributes = True
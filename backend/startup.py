@@ -0,0 +1,111 @@
+"""Background start-up work: warm-up imports and the storage credential check
+
+The lifespan hook only initialises the database. Everything slow (importing
+WeasyPrint and the Google API client, loading or refreshing Drive credentials,
+possibly through the interactive OAuth flow) runs in a daemon thread, so the
+server accepts requests straight away. The result of the credential check is
+reported by /api/drive/status, which checks again once it is older than
+STORAGE_STATUS_TTL (a revoked token, or OAuth completed on the first upload).
+
+Environment:
+    WARMUP=0                skip pre-importing heavy modules (they load on first use)
+    STARTUP_TIMING=1        log how long each start-up phase took
+    STORAGE_STATUS_TTL=60   seconds a storage check result is served before checking again
+"""
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+# Taken when main.py imports this module, before FastAPI and SQLAlchemy load
+IMPORT_STARTED = time.perf_counter()
+
+WARMUP_MODULES = [
+    "weasyprint",
+    "googleapiclient.discovery",
+    "googleapiclient.http",
+    "google_auth_oauthlib.flow",
+]
+
+_timings = {}
+_status = {"status": "pending", "message": "Checking storage credentials...", "checked_at": None}
+_status_lock = threading.Lock()
+# time.monotonic() of the last finished check
+_checked = None
+
+def timing_enabled() -> bool:
+    return os.environ.get("STARTUP_TIMING", "0") not in ("", "0", "false")
+
+def mark(phase: str):
+    """Record the time since IMPORT_STARTED at which `phase` finished"""
+    _timings[phase] = round((time.perf_counter() - IMPORT_STARTED) * 1000, 1)
+    if timing_enabled():
+        print(f"[startup] {phase}: {_timings[phase]} ms")
+
+def timings() -> dict:
+    """Milliseconds since main.py started importing, per start-up phase"""
+    return dict(_timings)
+
+def warm_up():
+    """Import heavy optional modules so the first PDF/upload request doesn't pay for it"""
+    import importlib
+    for module in WARMUP_MODULES:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            # Missing system libraries only matter when the module is actually used
+            print(f"Note: could not pre-import {module}: {e}")
+    mark("warmup")
+
+def _status_ttl() -> float:
+    return float(os.environ.get("STORAGE_STATUS_TTL", "60"))
+
+def _set_status(result: dict):
+    global _checked
+    with _status_lock:
+        _checked = time.monotonic()
+        _status.clear()
+        _status.update(result)
+        _status["checked_at"] = datetime.now(timezone.utc).isoformat()
+
+def check_storage():
+    """Run the storage health check (for Drive: load, refresh or obtain credentials)"""
+    from storage import get_storage
+
+    storage = get_storage()
+    if storage.name == "drive":
+        print("Checking Google Drive credentials...")
+    try:
+        result = storage.status()
+    except Exception as e:
+        result = {"status": "error", "message": str(e)}
+    _set_status(result)
+
+    if result.get("status") == "ok":
+        print(f"{storage.name} storage ready.")
+    elif storage.name == "drive":
+        print(f"Note: Google Drive authentication not completed on startup: {result.get('message')}")
+        print("Place credentials.json in the credentials/ folder; you will be prompted to authenticate when generating your first invoice.")
+    if "storage_check" not in _timings:
+        mark("storage_check")
+    return result
+
+def storage_status(refresh: bool = False) -> dict:
+    """Last storage check result, or a fresh check if `refresh` is set or the result is stale"""
+    with _status_lock:
+        # While the start-up check runs, report "pending" rather than start another
+        stale = _checked is not None and time.monotonic() - _checked > _status_ttl()
+        if not (refresh or stale):
+            return dict(_status)
+    return dict(check_storage())
+
+def _run_background():
+    if os.environ.get("WARMUP", "1") not in ("", "0", "false"):
+        warm_up()
+    check_storage()
+
+def start_background_tasks() -> threading.Thread:
+    """Start warm-up and the credential check without blocking start-up"""
+    thread = threading.Thread(target=_run_background, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,71 @@
+"""Compare two benchmark result files and flag regressions
+
+Usage:
+    python benchmarks/compare.py baseline.json candidate.json [--threshold 10] [--metric median]
+
+Exits with status 1 if any benchmark is slower than the baseline by more than
+the threshold (in percent), failed in the candidate run, or is missing from it.
+Benchmarks without a usable baseline are reported as "new".
+"""
+import argparse
+import json
+import sys
+
+import harness
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        report = json.load(f)
+    return {harness.result_key(r): r for r in report.get("results", [])}
+
+def compare(baseline: dict, candidate: dict, metric: str, threshold: float):
+    """Yield (key, old, new, change_pct, status) for every benchmark in either run"""
+    for key in sorted(set(baseline) | set(candidate)):
+        old = (baseline.get(key, {}).get("stats") or {}).get(metric)
+        new = (candidate.get(key, {}).get("stats") or {}).get(metric)
+        if key not in candidate:
+            yield key, old, new, None, "MISSING"
+            continue
+        if new is None:
+            yield key, old, new, None, "ERROR"
+            continue
+        if old is None:
+            yield key, old, new, None, "new"
+            continue
+        change = (new - old) / old * 100.0 if old else 0.0
+        if change > threshold:
+            status = "REGRESSION"
+        elif change < -threshold:
+            status = "improved"
+        else:
+            status = "ok"
+        yield key, old, new, change, status
+
+def _fmt(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:10.3f}ms"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Allowed slowdown in percent")
+    parser.add_argument("--metric", default="median", choices=["min", "mean", "median", "p95"])
+    args = parser.parse_args(argv)
+
+    rows = list(compare(load(args.baseline), load(args.candidate), args.metric, args.threshold))
+    width = max((len(row[0]) for row in rows), default=10)
+    regressions = failures = 0
+    for key, old, new, change, status in rows:
+        change_str = "" if change is None else f"{change:+7.1f}%"
+        print(f"{key:<{width}}  {_fmt(old)}  {_fmt(new)}  {change_str:>8}  {status}")
+        regressions += status == "REGRESSION"
+        failures += status in ("ERROR", "MISSING")
+
+    if regressions:
+        print(f"\n{regressions} regression(s) above {args.threshold:.0f}% ({args.metric})")
+    if failures:
+        print(f"\n{failures} benchmark(s) failed or missing in {args.candidate}")
+    return 1 if regressions or failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
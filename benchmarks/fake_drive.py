@@ -0,0 +1,199 @@
+"""In-memory stand-in for the Google Drive v3 service used by google_drive.py
+
+Only the calls the backend makes are implemented: files().list/get/create/update/delete,
+changes().getStartPageToken/list and about().get, each returning a request
+object with .execute().
+"""
+import itertools
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+_NAME_RE = re.compile(r"name='((?:[^'\\]|\\.)*)'")
+_PARENT_RE = re.compile(r"'([^']+)' in parents")
+_MIME_RE = re.compile(r"mimeType='([^']+)'")
+
+class _Request:
+    def __init__(self, service, fn):
+        self._service = service
+        self._fn = fn
+
+    def execute(self):
+        if self._service.latency:
+            time.sleep(self._service.latency)
+        self._service.calls += 1
+        return self._fn()
+
+class NotFound(Exception):
+    """Like googleapiclient's HttpError for a 404"""
+
+    class resp:
+        status = 404
+
+class _Files:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, fileId=None, fields=None, **kwargs):
+        def run():
+            with self._service.lock:
+                f = self._service.store.get(fileId)
+            if f is None:
+                raise NotFound(f"File not found: {fileId}")
+            return {"id": f["id"], "name": f["name"], "mimeType": f["mimeType"], "trashed": False}
+        return _Request(self._service, run)
+
+    def list(self, q="", spaces=None, fields=None, **kwargs):
+        def run():
+            name = _NAME_RE.search(q)
+            parent = _PARENT_RE.search(q)
+            mime = _MIME_RE.search(q)
+            matches = []
+            with self._service.lock:
+                for f in self._service.store.values():
+                    if name and f["name"] != name.group(1):
+                        continue
+                    if parent and parent.group(1) not in f["parents"]:
+                        continue
+                    if mime and f["mimeType"] != mime.group(1):
+                        continue
+                    matches.append({"id": f["id"], "name": f["name"], "parents": list(f["parents"])})
+            return {"files": matches}
+        return _Request(self._service, run)
+
+    def create(self, body=None, media_body=None, fields=None, **kwargs):
+        def run():
+            body_ = body or {}
+            size = media_body.size() if media_body is not None else 0
+            file_id = self._service.new_id()
+            parents = list(body_.get("parents") or ["root"])
+            with self._service.lock:
+                self._service.store[file_id] = {
+                    "id": file_id,
+                    "name": body_.get("name"),
+                    "mimeType": body_.get("mimeType") or (media_body.mimetype() if media_body is not None else None),
+                    "parents": parents,
+                    "size": size,
+                }
+                self._service.bytes_uploaded += size
+                self._service.log_change(file_id, self._service.store[file_id]["mimeType"])
+            return {
+                "id": file_id,
+                "webViewLink": f"https://drive.example.invalid/file/d/{file_id}/view",
+                "webContentLink": f"https://drive.example.invalid/uc?id={file_id}",
+            }
+        return _Request(self._service, run)
+
+    def update(self, fileId=None, body=None, media_body=None, fields=None, **kwargs):
+        def run():
+            size = media_body.size() if media_body is not None else 0
+            with self._service.lock:
+                f = self._service.store[fileId]
+                if body and body.get("name"):
+                    f["name"] = body["name"]
+                f["size"] = size
+                f["revision"] = f.get("revision", 1) + 1
+                self._service.bytes_uploaded += size
+                revision = f["revision"]
+            return {
+                "id": fileId,
+                "headRevisionId": f"rev{revision}",
+                "webViewLink": f"https://drive.example.invalid/file/d/{fileId}/view",
+                "webContentLink": f"https://drive.example.invalid/uc?id={fileId}",
+            }
+        return _Request(self._service, run)
+
+    def delete(self, fileId=None, **kwargs):
+        def run():
+            with self._service.lock:
+                doomed = {fileId}
+                # Deleting a folder deletes its descendants, as in Drive
+                changed = True
+                while changed:
+                    changed = False
+                    for f in self._service.store.values():
+                        if f["id"] not in doomed and doomed.intersection(f["parents"]):
+                            doomed.add(f["id"])
+                            changed = True
+                for file_id in doomed:
+                    self._service.store.pop(file_id, None)
+                    self._service.log_change(file_id)
+            return ""
+        return _Request(self._service, run)
+
+class _Changes:
+    """Page tokens are positions in the service's change log"""
+
+    def __init__(self, service):
+        self._service = service
+
+    def getStartPageToken(self, **kwargs):
+        return _Request(self._service, lambda: {"startPageToken": str(len(self._service.change_log))})
+
+    def list(self, pageToken=None, pageSize=100, **kwargs):
+        def run():
+            start = int(pageToken)
+            with self._service.lock:
+                changes = self._service.change_log[start:start + pageSize]
+                end = len(self._service.change_log)
+            if start + pageSize < end:
+                return {"changes": changes, "nextPageToken": str(start + pageSize)}
+            return {"changes": changes, "newStartPageToken": str(start + len(changes))}
+        return _Request(self._service, run)
+
+class _About:
+    def __init__(self, service):
+        self._service = service
+
+    def get(self, fields=None, **kwargs):
+        return _Request(self._service, lambda: {"user": {"displayName": "Benchmark"}})
+
+class FakeDriveService:
+    """Thread-safe in-memory Drive; `latency` seconds are added to every call"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.store = {}
+        self.calls = 0
+        self.bytes_uploaded = 0
+        self.lock = threading.Lock()
+        self.change_log = []
+        self._ids = itertools.count(1)
+
+    def new_id(self) -> str:
+        return f"fake{next(self._ids):08d}"
+
+    def log_change(self, file_id: str, mime_type: str = None):
+        """Record a change; without a mime_type the file was removed (call with lock held)"""
+        if mime_type is None:
+            self.change_log.append({"fileId": file_id, "removed": True})
+        else:
+            self.change_log.append({"fileId": file_id, "removed": False,
+                                    "file": {"mimeType": mime_type, "trashed": False}})
+
+    def files(self):
+        return _Files(self)
+
+    def changes(self):
+        return _Changes(self)
+
+    def about(self):
+        return _About(self)
+
+class _FakeCredentials:
+    valid = True
+    expired = False
+
+@contextmanager
+def fake_drive(service: FakeDriveService):
+    """Route google_drive.py through `service` instead of the Google API"""
+    import google_drive
+
+    saved = (google_drive.get_credentials, google_drive.build)
+    google_drive.get_credentials = lambda: _FakeCredentials()
+    google_drive.build = lambda *args, **kwargs: service
+    try:
+        yield service
+    finally:
+        google_drive.get_credentials, google_drive.build = saved
@@ -0,0 +1,80 @@
+"""Shared helpers for the benchmark suite: backend import path, timing and result records"""
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+BACKEND_DIR = os.path.join(REPO_DIR, "backend")
+DEFAULT_DATA_DIR = os.path.join(BENCH_DIR, ".data")
+
+# The backend uses flat imports (`from database import ...`), so it has to be on the path
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+def percentile(samples: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """Summary statistics (in seconds) for a list of timings"""
+    median = statistics.median(samples)
+    return {
+        "n": len(samples),
+        "min": min(samples),
+        "max": max(samples),
+        "mean": statistics.fmean(samples),
+        "median": median,
+        "p95": percentile(samples, 95),
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+        "ops_per_sec": (1.0 / median) if median > 0 else None,
+    }
+
+def measure(fn: Callable[[], object], repeat: int, warmup: int = 1) -> Dict[str, float]:
+    """Call fn `warmup` times untimed, then `repeat` times timed"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return summarize(samples)
+
+def result(name: str, dataset: Optional[str], params: Dict, stats: Optional[Dict] = None, error: Optional[str] = None) -> Dict:
+    """Build one result record; (name, dataset, params) identifies it across runs"""
+    record = {"name": name, "dataset": dataset, "params": params}
+    if error is not None:
+        record["error"] = error
+    else:
+        record["stats"] = stats
+    return record
+
+def result_key(record: Dict) -> str:
+    """Stable identifier used to match results between two runs"""
+    params = ",".join(f"{k}={v}" for k, v in sorted(record.get("params", {}).items()))
+    return f"{record['name']}[{record.get('dataset') or '-'}]({params})"
+
+def run_metadata() -> Dict:
+    """Environment description stored alongside results"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
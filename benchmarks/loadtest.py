@@ -0,0 +1,172 @@
+"""Multi-worker load test: throughput of `uvicorn --workers N` on one machine
+
+For each worker count, starts the app on a copy of a seeded dataset (local
+storage, direct PDF engine), drives it from several client processes for a
+fixed duration and reports requests/s, latency and the scaling efficiency
+relative to one worker. Invoices are created without a number, so the run
+also checks that concurrent allocation never hands out a number twice.
+
+Usage:
+    python benchmarks/loadtest.py --workers 1,2,4 --clients 16 --duration 15
+    python benchmarks/loadtest.py --output bench/load.json
+
+The load generator runs on the same machine, so leave it some cores: with
+C cores, worker counts up to about C/2 give meaningful numbers.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+import harness
+from seed import ensure_dataset
+from run import _free_port
+
+def _client(port: int, duration: float, create_ratio: float, seed: int) -> dict:
+    """One client process: keep-alive requests until `duration` elapses"""
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, statuses = [], {}
+    body = json.dumps({
+        "date": date.today().isoformat(),
+        "party_id": 1,
+        "line_items": [{"description": "Load test", "rate": 100.0, "quantity": 1.0, "unit": "days"}],
+    })
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        if rng.random() < create_ratio:
+            method, url, payload = "POST", "/api/invoices", body
+        else:
+            method, url, payload = "GET", rng.choice(["/api/invoices?limit=20", "/api/invoices/next-number"]), None
+        start = time.perf_counter()
+        try:
+            connection.request(method, url, body=payload, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            status = "connection_error"
+        latencies.append(time.perf_counter() - start)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    connection.close()
+    return {"latencies": latencies, "statuses": statuses}
+
+def _wait_ready(port: int, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/api/parties")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.05)
+    raise RuntimeError(f"server not ready after {timeout:.0f}s")
+
+def run_once(args, workers: int, dataset: str) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "load.db")
+        shutil.copyfile(dataset, db_path)
+        port = _free_port()
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{db_path}",
+            STORAGE_BACKEND="local",
+            LOCAL_STORAGE_DIR=os.path.join(tmp, "storage"),
+            LOCK_DIR=os.path.join(tmp, "locks"),
+            PDF_ENGINE="direct",
+            WARMUP="0",
+        )
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            cwd=harness.BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_ready(port, server)
+            with multiprocessing.Pool(args.clients) as pool:
+                outcomes = pool.starmap(
+                    _client, [(port, args.duration, args.create_ratio, n) for n in range(args.clients)]
+                )
+        finally:
+            server.terminate()
+            server.wait()
+
+        with sqlite3.connect(db_path) as conn:
+            total, distinct = conn.execute(
+                "SELECT COUNT(invoice_number), COUNT(DISTINCT invoice_number) FROM invoices"
+            ).fetchone()
+
+    latencies = [latency for outcome in outcomes for latency in outcome["latencies"]]
+    statuses = {}
+    for outcome in outcomes:
+        for status, count in outcome["statuses"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    stats = harness.summarize(latencies) if latencies else {}
+    stats.update({
+        "requests": len(latencies),
+        "requests_per_sec": len(latencies) / args.duration,
+        "statuses": statuses,
+        "duplicate_invoice_numbers": total - distinct,
+    })
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="Worker counts to test (comma separated)")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent client processes")
+    parser.add_argument("--duration", type=float, default=15.0, help="Seconds of load per worker count")
+    parser.add_argument("--create-ratio", type=float, default=0.2, help="Fraction of requests creating invoices")
+    parser.add_argument("--dataset", default="10k", help="Seeded dataset size to start from")
+    parser.add_argument("--data-dir", default=harness.DEFAULT_DATA_DIR)
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    dataset = ensure_dataset(args.data_dir, args.dataset)
+    results, baseline = [], None
+    for workers in [int(n) for n in args.workers.split(",") if n.strip()]:
+        params = {"workers": workers, "clients": args.clients, "create_ratio": args.create_ratio}
+        try:
+            stats = run_once(args, workers, dataset)
+        except Exception as e:
+            results.append(harness.result("loadtest", args.dataset, params, error=f"{type(e).__name__}: {e}"))
+            continue
+        if baseline is None and workers == 1:
+            baseline = stats["requests_per_sec"]
+        if baseline:
+            stats["scaling_efficiency"] = stats["requests_per_sec"] / (baseline * workers)
+        results.append(harness.result("loadtest", args.dataset, params, stats))
+        print(f"workers={workers}: {stats['requests_per_sec']:.1f} req/s, "
+              f"p95 {stats['p95'] * 1000:.1f} ms, statuses {stats['statuses']}", file=sys.stderr)
+
+    report = {"meta": harness.run_metadata(), "config": vars(args), "results": results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    failed = any(
+        r.get("error") or r["stats"]["duplicate_invoice_numbers"]
+        or any(s.startswith("5") or s == "409" or s == "connection_error" for s in r["stats"]["statuses"])
+        for r in results
+    )
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
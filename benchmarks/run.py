@@ -0,0 +1,417 @@
+"""Run the backend benchmark suite and emit results as JSON
+
+Usage:
+    python benchmarks/run.py                          # all groups, 1k/100k/1m datasets
+    python benchmarks/run.py --sizes 1k --groups api  # quick run
+    python benchmarks/run.py --output results/main.json
+    python benchmarks/run.py --groups storage --storage-latency-ms 40 --storage-error-rate 0.05
+    python benchmarks/run.py --groups startup --startup-repeat 10
+
+Compare two runs with benchmarks/compare.py.
+"""
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+# The app's own engine is never used by the benchmarks; keep it off the working directory
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import harness
+from seed import ensure_dataset
+
+from sqlalchemy.orm import sessionmaker
+
+DEFAULT_SIZES = "1k,100k,1m"
+DEFAULT_PDF_LINES = "1,50,500"
+GROUPS = ("pdf", "api", "storage", "startup")
+
+def _sample_invoice(line_count: int):
+    """Transient (unsaved) model objects for an invoice with `line_count` lines"""
+    from models import Party, Invoice, LineItem, Config
+
+    party = Party(
+        id=1, company_name="Benchmark Client SAS", contact_person="Jane Doe",
+        address="10 Avenue des Champs", city="75008 Paris", vat_number="FR00123456789",
+        payment_term="30 days",
+    )
+    config = Config(
+        id=1, brand_name="BENCHMARK BRAND", legal_name="Benchmark Legal Name",
+        siret="000 000 000 00000", phone="+33 1 00 00 00 00", email="billing@example.com",
+        address="1 Rue de la Paix, 75002 Paris", iban="FR76 0000 0000 0000 0000 0000 000",
+        bic="BENCHFRPP", vat_note="VAT not applicable, Art. 293 B of the French Tax Code",
+    )
+    invoice = Invoice(
+        id=1, invoice_number="20250101", date=date(2025, 1, 1), party_id=1, payment_term="30 days",
+    )
+    groups = [None, "Development", "Consulting"]
+    line_items = [
+        LineItem(
+            id=n + 1, invoice_id=1, description=f"Work item {n + 1}", rate=450.0 + n % 7,
+            quantity=float(n % 5 + 1), unit="days", group_name=groups[n % len(groups)],
+        )
+        for n in range(line_count)
+    ]
+    return invoice, party, config, line_items
+
+def bench_pdf(args):
+    results = []
+    try:
+        from pdf_generator import generate_pdf
+    except Exception as e:
+        return [harness.result("generate_pdf", None, {}, error=f"{type(e).__name__}: {e}")]
+
+    for engine in args.pdf_engines:
+        for line_count in args.pdf_lines:
+            params = {"lines": line_count, "engine": engine}
+            invoice, party, config, line_items = _sample_invoice(line_count)
+            try:
+                stats = harness.measure(
+                    lambda: generate_pdf(invoice, party, config, line_items, engine=engine),
+                    repeat=args.pdf_repeat,
+                )
+                stats["pdf_bytes"] = len(generate_pdf(invoice, party, config, line_items, engine=engine))
+                results.append(harness.result("generate_pdf", None, params, stats))
+            except Exception as e:
+                results.append(harness.result("generate_pdf", None, params, error=f"{type(e).__name__}: {e}"))
+    return results
+
+def _client_for(db_path: str):
+    """TestClient for the app with get_db pointed at `db_path` (lifespan is not run)"""
+    from fastapi.testclient import TestClient
+    import main
+    from database import get_db, init_db, make_engine
+
+    engine = make_engine(f"sqlite:///{db_path}")
+    # Cached datasets may predate newer tables and columns
+    init_db(engine)
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    main.app.dependency_overrides[get_db] = override_get_db
+    return TestClient(main.app), engine
+
+def _get(client, url):
+    response = client.get(url)
+    response.raise_for_status()
+    return response
+
+def _local_storage(root: str, args, **kwargs):
+    from storage import LocalStorage
+
+    return LocalStorage(
+        root,
+        latency=args.storage_latency_ms / 1000.0,
+        error_rate=args.storage_error_rate,
+        seed=0,
+        retry_backoff=args.storage_retry_backoff,
+        **kwargs,
+    )
+
+def _back_seeded_files(backend, engine):
+    """Point the seeded invoices at one real file and folder in `backend`
+
+    Their seed* IDs don't exist in local storage, so reconciliation (which
+    checks local storage in full) would clear and re-upload every one of them.
+    """
+    from sqlalchemy import text
+
+    folder_id = backend.ensure_folder("seed", backend.ensure_folder("Invoices"))
+    file_id, file_url = backend.put(folder_id, b"%PDF-1.4\n", "seed.pdf", "application/pdf")
+    with engine.begin() as conn:
+        conn.execute(
+            text("UPDATE invoices SET drive_file_id = :file_id, drive_file_url = :file_url, drive_folder_id = :folder_id"),
+            {"file_id": file_id, "file_url": file_url, "folder_id": folder_id},
+        )
+
+def bench_api_dataset(args, label: str):
+    from contextlib import nullcontext
+    from fake_drive import FakeDriveService, fake_drive
+    from storage import DriveStorage, set_storage
+
+    results = []
+    path = ensure_dataset(args.data_dir, label, force=args.reseed)
+
+    client, engine = _client_for(path)
+    try:
+        results.append(harness.result(
+            "list_invoices", label, {"limit": 100},
+            harness.measure(lambda: _get(client, "/api/invoices?limit=100"), repeat=args.repeat),
+        ))
+        results.append(harness.result(
+            "get_next_invoice_number", label, {},
+            harness.measure(lambda: _get(client, "/api/invoices/next-number"), repeat=args.repeat),
+        ))
+    finally:
+        engine.dispose()
+
+    # create_invoice writes, so it runs against a throwaway copy of the dataset
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = os.path.join(tmp, os.path.basename(path))
+        shutil.copyfile(path, scratch)
+        client, engine = _client_for(scratch)
+        if args.storage == "local":
+            backend = _local_storage(os.path.join(tmp, "storage"), args)
+            _back_seeded_files(backend, engine)
+            patch = nullcontext()
+            params = {"lines": args.create_lines, "storage": "local",
+                      "latency_ms": args.storage_latency_ms, "error_rate": args.storage_error_rate}
+        else:
+            service = FakeDriveService(latency=args.drive_latency_ms / 1000.0)
+            backend = DriveStorage()
+            patch = fake_drive(service)
+            params = {"lines": args.create_lines, "drive_latency_ms": args.drive_latency_ms}
+        set_storage(backend)
+        counter = iter(range(10 ** 9))
+
+        def create():
+            n = next(counter)
+            response = client.post("/api/invoices", json={
+                "invoice_number": f"BENCH{n:07d}",
+                "date": date.today().isoformat(),
+                "party_id": n % 200 + 1,
+                "line_items": [
+                    {"description": f"Item {i}", "rate": 500.0, "quantity": 1.0, "unit": "days"}
+                    for i in range(args.create_lines)
+                ],
+            })
+            response.raise_for_status()
+            return response
+
+        def bench_create():
+            stats = harness.measure(create, repeat=args.create_repeat)
+            stats["storage"] = dict(backend.metrics)
+            return stats
+
+        def bench_update():
+            # Edit one line of a fresh invoice: one render and one upload per update
+            invoice = create().json()
+            rates = iter(range(1, 10 ** 9))
+
+            def update():
+                items = invoice["line_items"]
+                items[0]["rate"] = float(next(rates))
+                response = client.put(f"/api/invoices/{invoice['id']}", json={
+                    "invoice_number": invoice["invoice_number"],
+                    "date": invoice["date"],
+                    "party_id": invoice["party_id"],
+                    "line_items": items,
+                })
+                response.raise_for_status()
+                return response
+
+            calls_before = backend.metrics["calls"]
+            stats = harness.measure(update, repeat=args.create_repeat)
+            stats["storage_calls_per_update"] = (backend.metrics["calls"] - calls_before) / (args.create_repeat + 1)
+            return stats
+
+        def bench_reconcile():
+            # Reconciliation reads the storage change feed, so its cost should
+            # not grow with the dataset (local storage has no feed and is
+            # checked in full). Each pass finds one invoice folder removed out
+            # of band and uploads the invoice again.
+            import reconcile
+            from models import Invoice
+
+            invoice = create().json()
+            db = sessionmaker(bind=engine)()
+            try:
+                reconcile.reset_changes_token(db, backend)
+
+                def reconcile_pass():
+                    folder_id = db.query(Invoice.drive_folder_id).filter(Invoice.id == invoice["id"]).scalar()
+                    backend.delete(folder_id)
+                    report = reconcile.reconcile(db, backend)
+                    expected = "changes" if backend.supports_changes else "full"
+                    if report["mode"] != expected or report["uploaded"] != 1:
+                        raise RuntimeError(f"unexpected reconcile report: {report}")
+                    return report
+
+                return harness.measure(reconcile_pass, repeat=args.create_repeat)
+            finally:
+                db.close()
+
+        try:
+            with patch:
+                # Each benchmark gets its own result or error record
+                for name, bench in (("create_invoice", bench_create), ("update_invoice", bench_update),
+                                    ("reconcile_changes", bench_reconcile)):
+                    try:
+                        results.append(harness.result(name, label, params, bench()))
+                    except Exception as e:
+                        results.append(harness.result(name, label, params, error=f"{type(e).__name__}: {e}"))
+        finally:
+            set_storage(None)
+            engine.dispose()
+
+    return results
+
+def bench_api(args):
+    try:
+        import main  # noqa: F401
+    except Exception as e:
+        return [harness.result("api", None, {}, error=f"could not import app: {type(e).__name__}: {e}")]
+
+    results = []
+    try:
+        for label in args.sizes:
+            results.extend(bench_api_dataset(args, label))
+    finally:
+        main.app.dependency_overrides.clear()
+    return results
+
+def bench_storage(args):
+    """Upload throughput and retries of the local storage backend, through batch()"""
+    results = []
+    payload = os.urandom(args.file_kb * 1024)
+    for workers in args.storage_workers:
+        params = {"workers": workers, "file_kb": args.file_kb, "files": args.storage_files,
+                  "latency_ms": args.storage_latency_ms, "error_rate": args.storage_error_rate}
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = _local_storage(tmp, args, batch_workers=workers)
+            folder_id = backend.ensure_invoice_folder("Benchmark Client", "20250101")
+            operations = [("put", (folder_id, payload, f"file_{n}.bin")) for n in range(args.storage_files)]
+            start = time.perf_counter()
+            outcomes = backend.batch(operations)
+            elapsed = time.perf_counter() - start
+        failed = sum(isinstance(o, Exception) for o in outcomes)
+        stats = harness.summarize([elapsed])
+        stats.update({
+            "files_per_sec": (len(operations) - failed) / elapsed,
+            "mb_per_sec": backend.metrics["bytes_uploaded"] / elapsed / (1024 * 1024),
+            "failed": failed,
+            "retries": backend.metrics["retries"],
+        })
+        results.append(harness.result("storage_batch_put", None, params, stats))
+    return results
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _start_server_once(tmp: str, timeout: float = 30.0):
+    """Launch uvicorn, return (seconds until the first request succeeded, /api/startup timings)"""
+    import urllib.request
+
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(tmp, 'startup.db')}",
+        STORAGE_BACKEND="local",
+        LOCAL_STORAGE_DIR=os.path.join(tmp, "storage"),
+    )
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=harness.BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with status {process.returncode}")
+            if time.perf_counter() - start > timeout:
+                raise RuntimeError(f"server not ready after {timeout:.0f}s")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/parties", timeout=1):
+                    elapsed = time.perf_counter() - start
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/startup", timeout=1) as response:
+                    phases = json.load(response)
+                return elapsed, phases
+            except OSError:
+                time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+def bench_startup(args):
+    """Cold start: process launch to first successful request"""
+    samples, ready_ms = [], []
+    params = {"server": "uvicorn"}
+    try:
+        for _ in range(args.startup_repeat):
+            with tempfile.TemporaryDirectory() as tmp:
+                elapsed, phases = _start_server_once(tmp)
+            samples.append(elapsed)
+            ready_ms.append(phases.get("ready"))
+    except Exception as e:
+        return [harness.result("startup_first_request", None, params, error=f"{type(e).__name__}: {e}")]
+    stats = harness.summarize(samples)
+    stats["app_ready_ms_median"] = sorted(ready_ms)[len(ready_ms) // 2]
+    return [harness.result("startup_first_request", None, params, stats)]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Dataset sizes in line items (comma separated)")
+    parser.add_argument("--groups", default=",".join(GROUPS), help="Benchmark groups to run: pdf, api, storage, startup")
+    parser.add_argument("--pdf-lines", default=DEFAULT_PDF_LINES, help="Line counts for generate_pdf")
+    parser.add_argument("--pdf-engines", default="html,direct", help="PDF engines to time (html, direct)")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed iterations for read endpoints")
+    parser.add_argument("--pdf-repeat", type=int, default=5, help="Timed iterations per PDF size")
+    parser.add_argument("--create-repeat", type=int, default=20, help="Invoices created per dataset")
+    parser.add_argument("--create-lines", type=int, default=10, help="Line items per created invoice")
+    parser.add_argument("--drive-latency-ms", type=float, default=0.0, help="Latency added to each fake Drive call")
+    parser.add_argument("--storage", choices=["fake-drive", "local"], default="fake-drive",
+                        help="Storage backend used by create_invoice")
+    parser.add_argument("--storage-latency-ms", type=float, default=0.0, help="Local storage latency per call")
+    parser.add_argument("--storage-error-rate", type=float, default=0.0, help="Local storage injected failure rate")
+    parser.add_argument("--storage-retry-backoff", type=float, default=0.01, help="Base retry backoff in seconds")
+    parser.add_argument("--storage-files", type=int, default=200, help="Files uploaded per storage run")
+    parser.add_argument("--storage-workers", default="1,8", help="Batch worker counts for the storage group")
+    parser.add_argument("--file-kb", type=int, default=64, help="Size of each uploaded file")
+    parser.add_argument("--startup-repeat", type=int, default=5, help="Server launches for the startup group")
+    parser.add_argument("--data-dir", default=harness.DEFAULT_DATA_DIR, help="Where seeded databases are cached")
+    parser.add_argument("--reseed", action="store_true", help="Rebuild cached datasets")
+    parser.add_argument("--output", help="Write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+    args.sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    args.groups = [g.strip() for g in args.groups.split(",") if g.strip()]
+    args.pdf_lines = [int(n) for n in args.pdf_lines.split(",") if n.strip()]
+    args.pdf_engines = [e.strip() for e in args.pdf_engines.split(",") if e.strip()]
+    args.storage_workers = [int(n) for n in args.storage_workers.split(",") if n.strip()]
+    unknown = set(args.groups) - set(GROUPS)
+    if unknown:
+        parser.error(f"unknown groups: {', '.join(sorted(unknown))}")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    # The backend prints progress (scheduler, reconciliation) to stdout, which
+    # must hold nothing but the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        if "pdf" in args.groups:
+            results.extend(bench_pdf(args))
+        if "api" in args.groups:
+            results.extend(bench_api(args))
+        if "storage" in args.groups:
+            results.extend(bench_storage(args))
+        if "startup" in args.groups:
+            results.extend(bench_startup(args))
+
+    report = {"meta": harness.run_metadata(), "config": vars(args), "results": results}
+    output = json.dumps(report, indent=2, default=str)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
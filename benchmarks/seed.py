@@ -0,0 +1,153 @@
+"""Seed synthetic invoice databases for benchmarking
+
+Usage:
+    python benchmarks/seed.py 100k            # writes benchmarks/.data/invoices_100k_YYYYMM.db
+    python benchmarks/seed.py 1m --force      # rebuild even if the file exists
+
+Invoices are dated relative to the day of seeding, so datasets are cached per
+month: a dataset seeded in an earlier month is rebuilt (and the stale file
+removed) on first use.
+"""
+import glob
+import argparse
+import os
+import random
+from datetime import date
+from typing import Optional
+
+import harness  # noqa: F401 - puts backend/ on sys.path
+
+from sqlalchemy import create_engine, insert
+
+from database import Base
+from models import Party, Invoice, LineItem, Config
+
+BATCH_SIZE = 20000
+ITEMS_PER_INVOICE = 10
+INVOICES_PER_MONTH = 60
+PARTY_COUNT = 200
+
+UNITS = ["days", "hours", "units"]
+GROUPS = [None, None, None, "Development", "Consulting", "Support"]
+
+def parse_size(label: str) -> int:
+    """'1k' -> 1000, '100k' -> 100000, '1m' -> 1000000"""
+    label = label.strip().lower()
+    multiplier = 1
+    if label.endswith("k"):
+        multiplier, label = 1000, label[:-1]
+    elif label.endswith("m"):
+        multiplier, label = 1000000, label[:-1]
+    return int(float(label) * multiplier)
+
+def dataset_path(data_dir: str, label: str, today: Optional[date] = None) -> str:
+    month = (today or date.today()).strftime("%Y%m")
+    return os.path.join(data_dir, f"invoices_{label.lower()}_{month}.db")
+
+def _month_back(today: date, months: int) -> date:
+    index = today.year * 12 + (today.month - 1) - months
+    return date(index // 12, index % 12 + 1, 1)
+
+def _insert_batches(conn, table, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        conn.execute(insert(table), rows[start:start + BATCH_SIZE])
+
+def seed_database(path: str, line_item_count: int, seed: int = 42, today: Optional[date] = None) -> dict:
+    """Create a SQLite database at `path` holding `line_item_count` line items
+
+    Invoices are numbered YYYYMM## going back month by month from today, so the
+    current month is populated and /api/invoices/next-number has work to do.
+    """
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+
+    invoice_count = max(1, line_item_count // ITEMS_PER_INVOICE)
+    today = today or date.today()
+
+    with engine.begin() as conn:
+        conn.execute(insert(Config.__table__), [{
+            "id": 1,
+            "brand_name": "BENCHMARK BRAND",
+            "legal_name": "Benchmark Legal Name",
+            "siret": "000 000 000 00000",
+            "email": "billing@example.com",
+            "address": "1 Rue de la Paix, 75002 Paris",
+            "iban": "FR76 0000 0000 0000 0000 0000 000",
+            "bic": "BENCHFRPP",
+            "vat_note": "VAT not applicable, Art. 293 B of the French Tax Code",
+        }])
+
+        _insert_batches(conn, Party.__table__, [{
+            "id": i,
+            "company_name": f"Client {i:04d}",
+            "contact_person": f"Contact {i}",
+            "address": f"{i} Benchmark Street",
+            "city": "Paris",
+            "vat_number": f"FR{i:011d}",
+            "payment_term": "30 days",
+        } for i in range(1, PARTY_COUNT + 1)])
+
+        invoices = []
+        for i in range(invoice_count):
+            month_start = _month_back(today, i // INVOICES_PER_MONTH)
+            sequence = i % INVOICES_PER_MONTH + 1
+            invoices.append({
+                "id": i + 1,
+                "invoice_number": f"{month_start:%Y%m}{sequence:02d}",
+                "date": month_start.replace(day=min(28, sequence)),
+                "party_id": rng.randint(1, PARTY_COUNT),
+                "payment_term": "30 days",
+                "drive_file_id": f"seed{i + 1:08d}",
+                "drive_file_url": f"https://drive.example.invalid/uc?id=seed{i + 1:08d}",
+                "drive_folder_id": f"seedfolder{i + 1:08d}",
+            })
+        _insert_batches(conn, Invoice.__table__, invoices)
+
+        rows = []
+        for n in range(line_item_count):
+            rows.append({
+                "invoice_id": n % invoice_count + 1,
+                "description": f"Line item {n}",
+                "rate": round(rng.uniform(50, 900), 2),
+                "quantity": float(rng.randint(1, 20)),
+                "unit": rng.choice(UNITS),
+                "group_name": rng.choice(GROUPS),
+            })
+            if len(rows) >= BATCH_SIZE:
+                conn.execute(insert(LineItem.__table__), rows)
+                rows = []
+        if rows:
+            conn.execute(insert(LineItem.__table__), rows)
+
+    engine.dispose()
+    return {"path": path, "line_items": line_item_count, "invoices": invoice_count, "parties": PARTY_COUNT}
+
+def ensure_dataset(data_dir: str, label: str, force: bool = False, today: Optional[date] = None) -> str:
+    """Return the path of this month's seeded database for `label`, seeding it if needed"""
+    today = today or date.today()
+    path = dataset_path(data_dir, label, today)
+    if force or not os.path.exists(path):
+        seed_database(path, parse_size(label), today=today)
+        # Datasets of earlier months would only be reused by mistake
+        for stale in glob.glob(os.path.join(data_dir, f"invoices_{label.lower()}_*.db")):
+            if stale != path:
+                os.remove(stale)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sizes", nargs="+", help="Dataset sizes in line items, e.g. 1k 100k 1m")
+    parser.add_argument("--data-dir", default=harness.DEFAULT_DATA_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild existing datasets")
+    args = parser.parse_args()
+    for label in args.sizes:
+        path = ensure_dataset(args.data_dir, label, force=args.force)
+        print(f"{label}: {path}")
+
+if __name__ == "__main__":
+    main()
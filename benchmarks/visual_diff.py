@@ -0,0 +1,105 @@
+"""Visual diff between the html (WeasyPrint) and direct (reportlab) PDF engines
+
+Renders the same invoices with both engines and checks that
+  * every word of the HTML rendering appears in the direct rendering, and
+  * each page looks alike: pages are rasterised, blurred to tolerate small
+    glyph and spacing differences, and the mean pixel difference must stay
+    under --threshold (0-1).
+
+Usage:
+    python benchmarks/visual_diff.py                     # 1, 20 and 120 line invoices
+    python benchmarks/visual_diff.py --lines 500 --out-dir /tmp/diff
+
+Needs pypdfium2 and Pillow (benchmarks/requirements.txt) and WeasyPrint's
+system libraries. Exits with status 1 if any invoice differs, 2 if an engine
+could not run.
+"""
+import argparse
+import json
+import os
+import sys
+from collections import Counter
+
+import harness  # noqa: F401 - puts backend/ on sys.path
+from run import _sample_invoice
+
+DPI = 50
+BLUR_RADIUS = 3
+
+def _pages(pdf_bytes: bytes):
+    import pypdfium2 as pdfium
+
+    document = pdfium.PdfDocument(pdf_bytes)
+    try:
+        for page in document:
+            image = page.render(scale=DPI / 72).to_pil().convert("L")
+            text = page.get_textpage().get_text_range()
+            yield image, text
+    finally:
+        document.close()
+
+def _words(text: str) -> Counter:
+    return Counter(text.split())
+
+def _page_difference(a, b) -> tuple:
+    from PIL import ImageChops, ImageFilter
+
+    if a.size != b.size:
+        b = b.resize(a.size)
+    a = a.filter(ImageFilter.GaussianBlur(BLUR_RADIUS))
+    b = b.filter(ImageFilter.GaussianBlur(BLUR_RADIUS))
+    diff = ImageChops.difference(a, b)
+    histogram = diff.histogram()
+    total = sum(value * count for value, count in enumerate(histogram))
+    return total / (255.0 * a.size[0] * a.size[1]), diff
+
+def compare(line_count: int, threshold: float, out_dir: str = None) -> dict:
+    from pdf_generator import generate_pdf
+
+    invoice, party, config, line_items = _sample_invoice(line_count)
+    html_pages = list(_pages(generate_pdf(invoice, party, config, line_items, engine="html")))
+    direct_pages = list(_pages(generate_pdf(invoice, party, config, line_items, engine="direct")))
+
+    html_words = _words(" ".join(text for _, text in html_pages))
+    direct_words = _words(" ".join(text for _, text in direct_pages))
+    missing = html_words - direct_words
+
+    scores = []
+    for index, ((html_image, _), (direct_image, _)) in enumerate(zip(html_pages, direct_pages)):
+        score, diff = _page_difference(html_image, direct_image)
+        scores.append(round(score, 4))
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+            prefix = os.path.join(out_dir, f"lines{line_count}_page{index + 1}")
+            html_image.save(f"{prefix}_html.png")
+            direct_image.save(f"{prefix}_direct.png")
+            diff.point(lambda v: min(255, v * 4)).save(f"{prefix}_diff.png")
+
+    ok = not missing and abs(len(html_pages) - len(direct_pages)) <= 1 and all(s <= threshold for s in scores)
+    return {
+        "lines": line_count,
+        "ok": ok,
+        "pages": {"html": len(html_pages), "direct": len(direct_pages)},
+        "page_scores": scores,
+        "missing_words": dict(missing.most_common(20)),
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lines", default="1,20,120", help="Line item counts to compare (comma separated)")
+    parser.add_argument("--threshold", type=float, default=0.06, help="Maximum mean pixel difference per page")
+    parser.add_argument("--out-dir", help="Write html/direct/diff PNGs per page here")
+    args = parser.parse_args(argv)
+
+    results = []
+    for line_count in [int(n) for n in args.lines.split(",") if n.strip()]:
+        try:
+            results.append(compare(line_count, args.threshold, args.out_dir))
+        except Exception as e:
+            print(json.dumps({"lines": line_count, "error": f"{type(e).__name__}: {e}"}, indent=2))
+            return 2
+    print(json.dumps({"threshold": args.threshold, "results": results}, indent=2))
+    return 0 if all(r["ok"] for r in results) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
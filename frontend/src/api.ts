@@ -37,6 +37,21 @@ export interface LineItem {
   group_name?: string;
 }
 
+export interface AttachmentSummary {
+  id: number;
+  filename: string;
+  size: number;
+  mime_type?: string;
+  drive_file_url?: string;
+}
+
+export interface Attachment extends AttachmentSummary {
+  invoice_id: number;
+  sha256: string;
+  drive_file_id?: string;
+  created_at: string;
+}
+
 export interface Invoice {
   id: number;
   invoice_number: string;
@@ -48,6 +63,7 @@ export interface Invoice {
   drive_folder_id?: string;
   party: Party;
   line_items: LineItem[];
+  attachments: AttachmentSummary[];
 }
 
 export interface InvoiceCreate {
@@ -85,7 +101,14 @@ export const getNextInvoiceNumber = () => api.get<{ invoice_number: string }>('/
 export const uploadInvoiceFile = (invoiceId: number, file: File) => {
   const formData = new FormData();
   formData.append('file', file);
-  return api.post<{ message: string; file_id: string; file_url: string; filename: string }>(
+  return api.post<{
+    message: string;
+    file_id: string;
+    file_url: string;
+    filename: string;
+    attachment_id: number;
+    duplicate: boolean;
+  }>(
     `/api/invoices/${invoiceId}/files`,
     formData,
     {
@@ -95,6 +118,7 @@ export const uploadInvoiceFile = (invoiceId: number, file: File) => {
     }
   );
 };
+export const getInvoiceFiles = (invoiceId: number) => api.get<Attachment[]>(`/api/invoices/${invoiceId}/files`);
 
 // Config API
 export const getConfig = () => api.get<Config>('/api/config');
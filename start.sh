@@ -19,7 +19,14 @@ echo "will open for Google Drive authentication. If it doesn't, check backend.lo
 cd backend
 source venv/bin/activate
 pip install -q -r requirements.txt 2>/dev/null || pip install -r requirements.txt
-uvicorn main:app --reload --port 8000 > ../backend.log 2>&1 &
+# WORKERS=N runs N backend processes (no auto-reload); see README "Multiple Workers"
+WORKERS=${WORKERS:-1}
+if [ "$WORKERS" -gt 1 ]; then
+    echo "Running $WORKERS backend workers"
+    uvicorn main:app --workers "$WORKERS" --port 8000 > ../backend.log 2>&1 &
+else
+    uvicorn main:app --reload --port 8000 > ../backend.log 2>&1 &
+fi
 BACKEND_PID=$!
 cd ..
 